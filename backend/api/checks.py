@@ -0,0 +1,22 @@
+from django.conf import settings
+from django.core.checks import Warning, register
+
+# Значение по умолчанию из core/settings.py, оно есть в открытом коде
+DEFAULT_SHORT_LINK_KEY = 'foodgram-short-links'
+
+
+@register()
+def short_link_key_check(app_configs, **kwargs):
+    # С открытым ключом по короткой ссылке восстанавливается id рецепта,
+    # а ссылки на все рецепты можно перебрать
+    if settings.DEBUG or settings.SHORT_LINK_KEY != DEFAULT_SHORT_LINK_KEY:
+        return []
+    return [Warning(
+        'SHORT_LINK_KEY не задан, используется ключ по умолчанию.',
+        hint=(
+            'Задайте в .env случайную строку SHORT_LINK_KEY. Смена ключа '
+            'меняет все выданные короткие ссылки, поэтому задайте его '
+            'до публикации ссылок.'
+        ),
+        id='api.W001',
+    )]
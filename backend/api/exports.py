@@ -0,0 +1,50 @@
+import csv
+import json
+
+
+class Echo:
+    # Псевдо-файл для csv.writer: возвращает строку вместо записи
+    def write(self, value):
+        return value
+
+
+def render_txt(items):
+    separator = ''
+    for item in items:
+        yield (
+            f"{separator}{item['ingredient__name']} "
+            f"({item['ingredient__measurement_unit']}) - {item['quantity']}"
+        )
+        separator = '\n'
+
+
+def render_csv(items):
+    writer = csv.writer(Echo())
+    yield writer.writerow(('Ингредиент', 'Ед. измерения', 'Количество'))
+    for item in items:
+        yield writer.writerow((
+            item['ingredient__name'],
+            item['ingredient__measurement_unit'],
+            item['quantity'],
+        ))
+
+
+def render_json(items):
+    separator = ''
+    yield '['
+    for item in items:
+        yield separator + json.dumps({
+            'name': item['ingredient__name'],
+            'measurement_unit': item['ingredient__measurement_unit'],
+            'amount': item['quantity'],
+        }, ensure_ascii=False)
+        separator = ','
+    yield ']'
+
+
+# Формат списка покупок: (генератор строк, content type)
+SHOPPING_CART_FORMATS = {
+    'txt': (render_txt, 'text/plain; charset=utf-8'),
+    'csv': (render_csv, 'text/csv; charset=utf-8'),
+    'json': (render_json, 'application/json'),
+}
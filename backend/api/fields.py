@@ -1,28 +1,64 @@
-import base64
-import uuid
+import binascii
+import re
+from tempfile import SpooledTemporaryFile
 
-from django.core.files.base import ContentFile
+from django.conf import settings
+from django.core.files import File
 from drf_extra_fields.fields import Base64ImageField
 from rest_framework import serializers
 
+from api.images import InvalidImage, normalize_upload
+
+# Размер куска base64, декодируемого за раз
+BASE64_CHUNK_SIZE = 64 * 1024
+BASE64_MARKER = ';base64,'
+WHITESPACE = re.compile(r'\s+')
+
+
+def decode_base64(data, offset=0):
+    """Декодирует base64 с позиции offset по кускам во временный файл,
+    который переходит из памяти на диск при превышении
+    FILE_UPLOAD_MAX_MEMORY_SIZE."""
+    file = SpooledTemporaryFile(max_size=settings.FILE_UPLOAD_MAX_MEMORY_SIZE)
+    rest = ''
+    for start in range(offset, len(data), BASE64_CHUNK_SIZE):
+        chunk = rest + WHITESPACE.sub('', data[start:start + BASE64_CHUNK_SIZE])
+        # Декодировать можно только группы по 4 символа
+        end = len(chunk) - len(chunk) % 4
+        file.write(binascii.a2b_base64(chunk[:end]))
+        rest = chunk[end:]
+    if rest:
+        file.close()
+        raise binascii.Error('Incorrect padding')
+    file.seek(0)
+    return File(file)
+
 
 class Binary64ImageField(Base64ImageField):
     def to_internal_value(self, data):
+        # Изображение сохраняется уже уменьшенным и без метаданных
+        file = self.decode(data)
+        try:
+            return normalize_upload(file)
+        except InvalidImage as error:
+            raise serializers.ValidationError(str(error))
+        finally:
+            file.close()
+
+    def decode(self, data):
+        # Файл из multipart/form-data Django уже записал на диск
+        # или в память по частям, его можно отдать как есть
         if hasattr(data, 'file') and hasattr(data.file, 'read'):
             return data
 
         if isinstance(data, str):
             if data.startswith('data:image'):
+                # Строку не копируем: декодируем сразу после заголовка
+                offset = data.find(BASE64_MARKER)
                 try:
-                    format, imgstr = data.split(';base64,')
-                    ext = format.split('/')[-1]
-
-                    # Генерируем уникальное имя файла
-                    file_name = f"{uuid.uuid4()}.{ext}"
-
-                    # Декодируем и создаем ContentFile
-                    decoded_file = base64.b64decode(imgstr)
-                    return ContentFile(decoded_file, name=file_name)
+                    if offset == -1:
+                        raise ValueError
+                    return decode_base64(data, offset + len(BASE64_MARKER))
                 except (ValueError, AttributeError, TypeError):
                     raise serializers.ValidationError("Некорректный формат base64 строки")
             else:
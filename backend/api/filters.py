@@ -1,10 +1,72 @@
+import json
+
 import django_filters
+from django.db import connections
+from django.db.models import BooleanField
+from django.db.models.expressions import RawSQL
+from recipes import search
 from recipes.models import Recipe
 
+from api.recipe_index import recipe_index
+
+
+def filter_ids(queryset, ids):
+    """queryset.filter(id__in=ids), где ids передаются одним параметром:
+    без тысяч плейсхолдеров в SQL и без предела числа параметров
+    SQLite."""
+    connection = connections[queryset.db]
+    column = '{}.{}'.format(
+        connection.ops.quote_name(queryset.model._meta.db_table),
+        connection.ops.quote_name(queryset.model._meta.pk.column),
+    )
+    ids = sorted(ids)
+    if connection.vendor == 'postgresql':
+        condition = RawSQL(
+            f'{column} = ANY(%s)', (ids,), output_field=BooleanField()
+        )
+    elif connection.vendor == 'sqlite':
+        condition = RawSQL(
+            f'{column} IN (SELECT value FROM json_each(%s))',
+            (json.dumps(ids),),
+            output_field=BooleanField(),
+        )
+    else:
+        return queryset.filter(pk__in=ids)
+    return queryset.filter(condition)
+
+
+class NumberInFilter(django_filters.BaseInFilter, django_filters.NumberFilter):
+    pass
+
 
 class RecipeFilter(django_filters.FilterSet):
     author = django_filters.NumberFilter(field_name='author__id')
+    search = django_filters.CharFilter(method='filter_search')
+    # Списки id ингредиентов через запятую
+    ingredients_all = NumberInFilter(method='filter_ingredients')
+    ingredients_any = NumberInFilter(method='filter_ingredients')
+    ingredients_only = NumberInFilter(method='filter_ingredients')
 
     class Meta:
         model = Recipe
         fields = ['author']
+
+    def filter_search(self, queryset, name, value):
+        # Полнотекстовый поиск по названию и описанию,
+        # самые подходящие рецепты идут первыми
+        if not value.strip():
+            return queryset
+        return search.search(queryset, value).order_by('-search_rank', 'id')
+
+    def filter_ingredients(self, queryset, name, value):
+        # Подходящие рецепты берутся из индекса в памяти,
+        # в базу уходит только фильтр по их id
+        lookup = {
+            'ingredients_all': recipe_index.with_all,
+            'ingredients_any': recipe_index.with_any,
+            'ingredients_only': recipe_index.with_only,
+        }[name]
+        recipe_ids = lookup({int(ingredient_id) for ingredient_id in value})
+        if not recipe_ids:
+            return queryset.none()
+        return filter_ids(queryset, recipe_ids)
@@ -0,0 +1,126 @@
+import io
+import os
+import uuid
+
+from django.core.files.base import ContentFile
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+# Загруженные изображения уменьшаются до этих размеров
+MAX_IMAGE_SIZE = (1920, 1920)
+# Заранее подготовленные размеры для списков и карточек
+IMAGE_VARIANTS = {
+    'thumb': (320, 320),
+    'card': (800, 800),
+}
+# WebP для браузеров, которые его понимают, и JPEG для остальных
+VARIANT_FORMATS = {
+    'webp': ('WEBP', {'quality': 80, 'method': 4}),
+    'jpg': ('JPEG', {'quality': 82, 'optimize': True, 'progressive': True}),
+}
+
+
+class InvalidImage(ValueError):
+    pass
+
+
+def open_image(file, size):
+    """Открывает изображение, поворачивает по EXIF и уменьшает
+    до size с сохранением пропорций."""
+    try:
+        image = Image.open(file)
+        # JPEG декодируется сразу в уменьшенном масштабе
+        image.draft('RGB', size)
+        image = ImageOps.exif_transpose(image)
+    except (UnidentifiedImageError, Image.DecompressionBombError, OSError):
+        raise InvalidImage('Файл не является изображением')
+    image.thumbnail(size, Image.Resampling.LANCZOS)
+    return image
+
+
+def encode(image, ext):
+    image_format, options = VARIANT_FORMATS[ext]
+    if image_format == 'JPEG' or image.mode not in ('RGB', 'RGBA'):
+        image = flatten(image, keep_alpha=image_format != 'JPEG')
+    buffer = io.BytesIO()
+    # EXIF и прочие метаданные не переносятся, кроме цветового профиля
+    image.save(
+        buffer,
+        image_format,
+        icc_profile=image.info.get('icc_profile'),
+        **options,
+    )
+    return buffer.getvalue()
+
+
+def flatten(image, keep_alpha):
+    if image.mode in ('P', 'LA', 'PA') or 'transparency' in image.info:
+        image = image.convert('RGBA')
+    if image.mode == 'RGBA' and not keep_alpha:
+        background = Image.new('RGB', image.size, 'white')
+        background.paste(image, mask=image.getchannel('A'))
+        background.info = image.info
+        return background
+    if image.mode not in ('RGB', 'RGBA'):
+        return image.convert('RGB')
+    return image
+
+
+def normalize_upload(file):
+    """Приводит загруженное изображение к WebP ограниченного размера
+    без метаданных."""
+    image = open_image(file, MAX_IMAGE_SIZE)
+    return ContentFile(encode(image, 'webp'), name=f'{uuid.uuid4()}.webp')
+
+
+def variant_name(name, size, ext):
+    stem, _ = os.path.splitext(name)
+    return f'{stem}_{size}.{ext}'
+
+
+def variant_urls(field_file):
+    """Ссылки на варианты изображения: {размер: {расширение: url}}.
+    Вместо несозданного варианта (ошибка при сохранении, изображение
+    загружено до появления вариантов) отдаётся ссылка на оригинал."""
+    if not field_file:
+        return {}
+    storage = field_file.storage
+    urls = {}
+    for size in IMAGE_VARIANTS:
+        urls[size] = {}
+        for ext in VARIANT_FORMATS:
+            name = variant_name(field_file.name, size, ext)
+            urls[size][ext] = (
+                storage.url(name) if storage.exists(name) else field_file.url
+            )
+    return urls
+
+
+def generate_variants(field_file):
+    """Создаёт недостающие варианты изображения.
+    Возвращает число созданных файлов."""
+    if not field_file:
+        return 0
+    storage = field_file.storage
+    missing = [
+        (size, ext)
+        for size in IMAGE_VARIANTS
+        for ext in VARIANT_FORMATS
+        if not storage.exists(variant_name(field_file.name, size, ext))
+    ]
+    if not missing:
+        return 0
+    with storage.open(field_file.name, 'rb') as file:
+        original = open_image(file, max(IMAGE_VARIANTS.values()))
+        original.load()
+    images = {}
+    for size, ext in missing:
+        if size not in images:
+            images[size] = original.copy()
+            images[size].thumbnail(
+                IMAGE_VARIANTS[size], Image.Resampling.LANCZOS
+            )
+        storage.save(
+            variant_name(field_file.name, size, ext),
+            ContentFile(encode(images[size], ext)),
+        )
+    return len(missing)
@@ -0,0 +1,167 @@
+import bisect
+import threading
+import uuid
+
+from django.core.cache import cache
+
+from recipes.models import Ingredient
+
+VERSION_CACHE_KEY = 'ingredient-index-version'
+# С какой длины запроса ищем по подстроке и с опечатками
+EXTENDED_SEARCH_MIN_LENGTH = 3
+
+
+def normalize(text):
+    return text.casefold().replace('ё', 'е').strip()
+
+
+def max_typos(query):
+    return 1 if len(query) <= 5 else 2
+
+
+def next_row(previous, query, char):
+    # Следующая строка матрицы Левенштейна при переходе по букве char
+    row = [previous[0] + 1]
+    for i, query_char in enumerate(query, 1):
+        row.append(min(
+            row[i - 1] + 1,
+            previous[i] + 1,
+            previous[i - 1] + (query_char != char),
+        ))
+    return row
+
+
+def subtree_positions(node):
+    stack = [node]
+    while stack:
+        node = stack.pop()
+        for char, child in node.items():
+            if char is None:
+                yield from child
+            else:
+                stack.append(child)
+
+
+class IngredientIndex:
+    """Индекс ингредиентов в памяти процесса для автодополнения.
+
+    Строится лениво и перестраивается, когда в кэше меняется версия
+    справочника (см. invalidate)."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.version = None
+        self.ingredients = None
+        self.keys = []
+        self.trie = {}
+        self.updated_at = None
+
+    def build(self, version):
+        ingredients = sorted(
+            Ingredient.objects.all(),
+            key=lambda ingredient: (normalize(ingredient.name), ingredient.id),
+        )
+        keys = [normalize(ingredient.name) for ingredient in ingredients]
+        # Префиксное дерево слов названий для поиска с опечатками.
+        # Ключ None в узле хранит позиции названий, где слово заканчивается
+        trie = {}
+        for position, key in enumerate(keys):
+            for word in key.split():
+                node = trie
+                for char in word:
+                    node = node.setdefault(char, {})
+                node.setdefault(None, set()).add(position)
+        self.keys = keys
+        self.trie = trie
+        self.ingredients = ingredients
+        self.updated_at = max(
+            (ingredient.updated_at for ingredient in ingredients), default=None
+        )
+        self.version = version
+
+    def fingerprint(self):
+        # Меняется при любом добавлении, изменении или удалении ингредиента
+        self.ensure_fresh()
+        return len(self.ingredients), self.updated_at
+
+    def ensure_fresh(self):
+        version = cache.get(VERSION_CACHE_KEY)
+        if self.ingredients is not None and version == self.version:
+            return
+        with self.lock:
+            if self.ingredients is None or version != self.version:
+                self.build(version)
+
+    def all(self):
+        self.ensure_fresh()
+        return list(self.ingredients)
+
+    def search(self, query):
+        """Ингредиенты, подходящие под запрос: сначала совпадения по началу
+        названия, затем по подстроке, затем с опечатками."""
+        self.ensure_fresh()
+        query = normalize(query)
+        if not query:
+            return self.all()
+        keys, ingredients = self.keys, self.ingredients
+
+        start = bisect.bisect_left(keys, query)
+        end = start
+        while end < len(keys) and keys[end].startswith(query):
+            end += 1
+        found = list(range(start, end))
+
+        if len(query) >= EXTENDED_SEARCH_MIN_LENGTH:
+            matched = set(found)
+            found.extend(
+                position for position, key in enumerate(keys)
+                if query in key and position not in matched
+            )
+            if not found:
+                found = self.fuzzy_search(query)
+
+        return [ingredients[position] for position in found]
+
+    def fuzzy_search(self, query):
+        """Позиции названий, в которых есть слово, начинающееся с запроса
+        с точностью до нескольких опечаток. Опечатку в первой букве не ищем:
+        это отсекает большую часть дерева."""
+        limit = max_typos(query)
+        distances = {}
+
+        def record(positions, distance):
+            for position in positions:
+                distances[position] = min(
+                    distance, distances.get(position, distance)
+                )
+
+        def walk(node, row, best):
+            best = min(best, row[-1])
+            if min(row) > limit:
+                # Глубже расстояние не уменьшится, а всё поддерево
+                # уже совпало с запросом с точностью best
+                if best <= limit:
+                    record(subtree_positions(node), best)
+                return
+            for char, child in node.items():
+                if char is None:
+                    if best <= limit:
+                        record(child, best)
+                else:
+                    walk(child, next_row(row, query, char), best)
+
+        first = self.trie.get(query[0])
+        if first is not None:
+            row = next_row(list(range(len(query) + 1)), query, query[0])
+            walk(first, row, limit + 1)
+        return sorted(distances, key=lambda position: (
+            distances[position], position
+        ))
+
+
+def invalidate():
+    # Смена версии заставляет индекс перестроиться при следующем поиске
+    cache.set(VERSION_CACHE_KEY, uuid.uuid4().hex, timeout=None)
+
+
+ingredient_index = IngredientIndex()
@@ -0,0 +1,311 @@
+import difflib
+import random
+import re
+import time
+from itertools import islice
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import AnonymousUser
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test import RequestFactory
+from django.test.utils import CaptureQueriesContext
+from rest_framework.request import Request
+
+from api.views import RecipeViewSet, UserCustomViewSet
+from recipes.models import Ingredient, IngredientRecipe, Recipe
+from users import shopping_list
+from users.models import Favorite, Follow, ShoppingCart
+
+User = get_user_model()
+
+BATCH_SIZE = 5000
+INGREDIENT_PREFIXES = (
+    'абрикос', 'базилик', 'говядина', 'имбирь', 'картофель', 'капуста',
+    'лук', 'молоко', 'морковь', 'перец', 'рис', 'сахар', 'сыр', 'томат',
+)
+CASE_HEADER = re.compile(r'^== (.+) ==$')
+# Числа, которые меняются от запуска к запуску и не говорят о плане
+VOLATILE = (
+    re.compile(r'\(cost=[^)]*\)'),
+    re.compile(r'\(actual[^)]*\)'),
+    re.compile(r'^\s*(Planning|Execution) Time:.*$'),
+    re.compile(r'^\s*Buffers:.*$'),
+    re.compile(r'^\s*Heap Blocks:.*$'),
+    re.compile(r'^\s*Rows Removed by .*$'),
+    re.compile(r'^time: .*$'),
+)
+
+
+def batched(objects, size=BATCH_SIZE):
+    objects = iter(objects)
+    while batch := list(islice(objects, size)):
+        yield batch
+
+
+def normalize_plan(text):
+    lines = []
+    for line in text.splitlines():
+        for pattern in VOLATILE:
+            line = pattern.sub('', line)
+        if line.strip():
+            lines.append(line.rstrip())
+    return lines
+
+
+def parse_report(text):
+    # Сравниваются только планы: текст запросов зависит от id в данных
+    cases, name, in_sql = {}, None, False
+    for line in text.splitlines():
+        match = CASE_HEADER.match(line)
+        if match:
+            name, in_sql = match.group(1), False
+            cases[name] = []
+        elif line.startswith('-- query'):
+            in_sql = True
+        elif line == '-- plan':
+            in_sql = False
+        elif name is not None and not in_sql:
+            cases[name].append(line)
+    return {name: normalize_plan('\n'.join(lines))
+            for name, lines in cases.items()}
+
+
+class Command(BaseCommand):
+    help = (
+        'Заполняет базу тестовыми данными, выполняет запросы из api/views.py '
+        'и записывает их планы (EXPLAIN ANALYZE). Данные удаляются откатом '
+        'транзакции'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=2000)
+        parser.add_argument('--recipes', type=int, default=20000)
+        parser.add_argument('--ingredients', type=int, default=2000)
+        parser.add_argument('--ingredients-per-recipe', type=int, default=8)
+        parser.add_argument('--follows', type=int, default=20)
+        parser.add_argument('--favorites', type=int, default=30)
+        parser.add_argument('--cart', type=int, default=10)
+        parser.add_argument('--repeat', type=int, default=5)
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument(
+            '--no-seed', action='store_true',
+            help='Не добавлять тестовые данные, использовать имеющиеся',
+        )
+        parser.add_argument(
+            '--output', metavar='PATH', help='Файл для отчёта с планами',
+        )
+        parser.add_argument(
+            '--compare', metavar='PATH',
+            help='Сравнить планы с отчётом предыдущего запуска',
+        )
+
+    def handle(self, *args, **options):
+        self.options = options
+        self.random = random.Random(options['seed'])
+        with transaction.atomic():
+            if not options['no_seed']:
+                self.seed()
+            report = self.run_cases()
+            # Тестовые данные не сохраняются
+            transaction.set_rollback(True)
+
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as file:
+                file.write(report)
+            self.stdout.write(f'Отчёт записан в {options["output"]}')
+        else:
+            self.stdout.write(report)
+        if options['compare']:
+            self.compare(report, options['compare'])
+
+    def seed(self):
+        options = self.options
+        started = time.monotonic()
+        ingredients = Ingredient.objects.bulk_create(
+            Ingredient(
+                name=f'{self.random.choice(INGREDIENT_PREFIXES)} {number}',
+                measurement_unit='г',
+            )
+            for number in range(options['ingredients'])
+        )
+        users = []
+        for batch in batched(
+            User(
+                username=f'benchmark{number}',
+                email=f'benchmark{number}@example.com',
+                first_name='Бенчмарк',
+                last_name=str(number),
+                password='!',
+            )
+            for number in range(options['users'])
+        ):
+            users.extend(User.objects.bulk_create(batch))
+        # Авторы рецептов распределены неравномерно, как в жизни
+        weights = [1 / (rank + 1) for rank in range(len(users))]
+        recipes = []
+        for batch in batched(
+            Recipe(
+                author=self.random.choices(users, weights)[0],
+                name=f'Рецепт {number}',
+                image='recipes/benchmark.webp',
+                text='Нарезать, смешать и запечь. ' * 5,
+                cooking_time=self.random.randint(5, 120),
+            )
+            for number in range(options['recipes'])
+        ):
+            recipes.extend(Recipe.objects.bulk_create(batch))
+        for batch in batched(
+            IngredientRecipe(
+                recipe=recipe, ingredient=ingredient,
+                amount=self.random.randint(1, 500),
+            )
+            for recipe in recipes
+            for ingredient in self.random.sample(
+                ingredients, options['ingredients_per_recipe']
+            )
+        ):
+            IngredientRecipe.objects.bulk_create(batch)
+        for model, count, targets in (
+            (Follow, options['follows'], users),
+            (Favorite, options['favorites'], recipes),
+            (ShoppingCart, options['cart'], recipes),
+        ):
+            field = 'following' if model is Follow else 'recipe'
+            for batch in batched(
+                model(user=user, **{field: target})
+                for user in users
+                for target in self.random.sample(targets, count)
+                if target != user
+            ):
+                model.objects.bulk_create(batch, ignore_conflicts=True)
+        self.user = users[0]
+        self.author = users[0]
+        shopping_list.rebuild([self.user.id])
+        if connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                cursor.execute('ANALYZE')
+        self.stderr.write(
+            f'Тестовые данные добавлены за {time.monotonic() - started:.1f} с'
+        )
+
+    def make_view(self, viewset_class, action, user, params=None):
+        request = Request(RequestFactory().get('/', params or {}))
+        request.user = user
+        return viewset_class(
+            action=action, request=request, format_kwarg=None, kwargs={}
+        )
+
+    def get_cases(self):
+        if self.options['no_seed']:
+            self.user = User.objects.filter(favorites__isnull=False).first()
+            self.author = User.objects.filter(recipes__isnull=False).first()
+            if self.user is None or self.author is None:
+                raise CommandError('В базе нет данных для замеров')
+        user, author = self.user, self.author
+        recipe = Recipe.objects.order_by('-id').first()
+
+        def recipes(user, params=None, page=slice(0, 6)):
+            view = self.make_view(RecipeViewSet, 'list', user, params)
+            return lambda: list(
+                view.filter_queryset(view.get_queryset())[page]
+            )
+
+        def recipes_count(user, params):
+            view = self.make_view(RecipeViewSet, 'list', user, params)
+            return lambda: view.filter_queryset(view.get_queryset()).count()
+
+        retrieve = self.make_view(RecipeViewSet, 'retrieve', user)
+        cart = self.make_view(RecipeViewSet, 'download_cart', user)
+        subscriptions = self.make_view(
+            UserCustomViewSet, 'subscriptions', user, {'recipes_limit': 3}
+        )
+        return {
+            'recipes: list (anonymous)': recipes(AnonymousUser()),
+            'recipes: list (authenticated)': recipes(user),
+            'recipes: deep page': recipes(user, page=slice(6000, 6006)),
+            'recipes: author filter': recipes(
+                user, {'author': author.id}
+            ),
+            'recipes: author filter count': recipes_count(
+                user, {'author': author.id}
+            ),
+            'recipes: is_favorited': recipes(user, {'is_favorited': 1}),
+            'recipes: is_in_shopping_cart': recipes(
+                user, {'is_in_shopping_cart': 1}
+            ),
+            'recipes: retrieve validators': (
+                lambda: retrieve.get_recipe_validators(recipe.id)
+            ),
+            'users: subscriptions': lambda: list(
+                subscriptions.get_subscriptions_queryset(
+                    subscriptions.request
+                )[:6]
+            ),
+            'recipes: download_shopping_cart': (
+                lambda: list(cart.get_ingredients(user))
+            ),
+            # API ищет ингредиенты в индексе в памяти; случай проверяет,
+            # что префиксный поиск через ORM (скрипты, выгрузки) идёт
+            # по ingredient_name_prefix_idx
+            'ingredients: name prefix (ORM)': lambda: list(
+                Ingredient.objects.filter(name__istartswith='кар')[:10]
+            ),
+        }
+
+    def run_cases(self):
+        lines = [f'# {connection.vendor}, {self.describe_data()}']
+        for name, run in self.get_cases().items():
+            timings = []
+            for _ in range(self.options['repeat']):
+                with CaptureQueriesContext(connection) as context:
+                    started = time.perf_counter()
+                    run()
+                    timings.append(time.perf_counter() - started)
+            lines.append(f'== {name} ==')
+            lines.append(
+                f'time: {min(timings) * 1000:.2f} ms '
+                f'(best of {len(timings)}), queries: '
+                f'{len(context.captured_queries)}'
+            )
+            for number, query in enumerate(context.captured_queries, 1):
+                lines.append(f'-- query {number}')
+                lines.append(query['sql'])
+                lines.append('-- plan')
+                lines.extend(self.explain(query['sql']))
+        return '\n'.join(lines) + '\n'
+
+    def describe_data(self):
+        return ', '.join(
+            f'{model._meta.verbose_name_plural}: {model.objects.count()}'
+            for model in (User, Recipe, IngredientRecipe, Ingredient)
+        )
+
+    def explain(self, sql):
+        if connection.vendor == 'postgresql':
+            prefix = 'EXPLAIN (ANALYZE, BUFFERS) '
+        else:
+            prefix = 'EXPLAIN QUERY PLAN '
+        with connection.cursor() as cursor:
+            cursor.execute(prefix + sql)
+            rows = cursor.fetchall()
+        return [' '.join(str(value) for value in row) for row in rows]
+
+    def compare(self, report, path):
+        with open(path, encoding='utf-8') as file:
+            previous = parse_report(file.read())
+        current = parse_report(report)
+        changed = False
+        for name in sorted(set(previous) | set(current)):
+            diff = list(difflib.unified_diff(
+                previous.get(name, []), current.get(name, []),
+                fromfile=f'{path}: {name}', tofile=f'текущий: {name}',
+                lineterm='',
+            ))
+            if diff:
+                changed = True
+                self.stdout.write('\n'.join(diff))
+        if changed:
+            self.stdout.write(self.style.WARNING('Планы запросов изменились'))
+        else:
+            self.stdout.write(self.style.SUCCESS('Планы запросов не изменились'))
@@ -0,0 +1,135 @@
+import os
+import posixpath
+import shutil
+import time
+
+from django.apps import apps
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand, CommandError
+
+from api.images import IMAGE_VARIANTS
+
+DEFAULT_REFERENCES = ('recipes.Recipe.image', 'users.User.avatar')
+
+
+class Command(BaseCommand):
+    help = (
+        'Удаляет из MEDIA_ROOT файлы, на которые не ссылается '
+        'ни один рецепт или пользователь'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dry-run', action='store_true',
+            help='Только показать, что будет удалено',
+        )
+        parser.add_argument(
+            '--quarantine', metavar='PATH',
+            help='Переносить файлы в этот каталог вместо удаления',
+        )
+        parser.add_argument(
+            '--min-age', type=int, default=3600, metavar='SECONDS',
+            help='Не трогать файлы моложе указанного возраста: они могут '
+                 'принадлежать ещё не сохранённому объекту',
+        )
+
+    def handle(self, *args, **options):
+        self.verbosity = options['verbosity']
+        self.dry_run = options['dry_run']
+        self.quarantine = options['quarantine']
+        self.root = default_storage.location
+        self.fields = [
+            self.resolve_field(reference)
+            for reference in getattr(
+                default_storage, 'references', DEFAULT_REFERENCES
+            )
+        ]
+        self.modified_before = time.time() - options['min_age']
+        self.scanned = self.removed = self.freed = 0
+        self.roots = {field.upload_to.strip('/') for _, field in self.fields}
+
+        for directory in sorted(self.roots):
+            if os.path.isdir(os.path.join(self.root, directory)):
+                self.collect(directory)
+
+        action = 'будет удалено' if self.dry_run else 'удалено'
+        self.stdout.write(self.style.SUCCESS(
+            f'Проверено файлов: {self.scanned}, {action}: '
+            f'{self.removed} ({self.freed / 1024 ** 2:.1f} МБ)'
+        ))
+
+    def resolve_field(self, reference):
+        app_label, model_name, field_name = reference.split('.')
+        model = apps.get_model(app_label, model_name)
+        field = model._meta.get_field(field_name)
+        if not isinstance(field.upload_to, str):
+            raise CommandError(f'{reference}: upload_to должен быть строкой')
+        return model, field
+
+    def referenced_names(self, directory):
+        """Имена файлов каталога, на которые есть ссылки в базе.
+        Читаются частями, в памяти только ссылки одного каталога."""
+        names = set()
+        prefix = f'{directory}/'
+        for model, field in self.fields:
+            queryset = (
+                model._default_manager
+                .filter(**{f'{field.name}__startswith': prefix})
+                .values_list(field.name, flat=True)
+            )
+            for name in queryset.iterator(chunk_size=2000):
+                if posixpath.dirname(name) == directory:
+                    names.add(posixpath.basename(name))
+        return names
+
+    def collect(self, directory):
+        # Каталоги обходятся по одному, файлы читаются потоком os.scandir
+        stack = [directory]
+        while stack:
+            directory = stack.pop()
+            referenced = self.referenced_names(directory)
+            stems = {os.path.splitext(name)[0] for name in referenced}
+            path = os.path.join(self.root, directory)
+            with os.scandir(path) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        stack.append(posixpath.join(directory, entry.name))
+                    elif entry.is_file(follow_symlinks=False):
+                        self.scanned += 1
+                        if not self.is_used(entry.name, referenced, stems):
+                            self.remove(directory, entry)
+            if not self.dry_run and directory not in self.roots:
+                self.remove_if_empty(path)
+
+    def is_used(self, filename, referenced, stems):
+        if filename in referenced:
+            return True
+        # Вариант изображения <имя>_<размер>.<расширение> живёт,
+        # пока жив исходный файл
+        stem, _ = os.path.splitext(filename)
+        original, _, size = stem.rpartition('_')
+        return size in IMAGE_VARIANTS and original in stems
+
+    def remove(self, directory, entry):
+        stat = entry.stat(follow_symlinks=False)
+        if stat.st_mtime > self.modified_before:
+            return
+        self.removed += 1
+        self.freed += stat.st_size
+        name = posixpath.join(directory, entry.name)
+        if self.verbosity > 1:
+            self.stdout.write(name)
+        if self.dry_run:
+            return
+        if self.quarantine:
+            target = os.path.join(self.quarantine, name)
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            shutil.move(entry.path, target)
+        else:
+            os.remove(entry.path)
+
+    def remove_if_empty(self, path):
+        try:
+            os.rmdir(path)
+        except OSError:
+            pass
@@ -0,0 +1,32 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+
+from api.images import InvalidImage, generate_variants
+from api.serializers import invalidate_recipe_representations
+from recipes.models import Recipe
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = 'Создаёт недостающие уменьшенные копии изображений рецептов и аватаров'
+
+    def handle(self, *args, **options):
+        created = 0
+        sources = (
+            (Recipe.objects.exclude(image=''), 'image'),
+            (User.objects.exclude(avatar='').exclude(avatar=None), 'avatar'),
+        )
+        for queryset, field in sources:
+            for obj in queryset.only('id', field).iterator():
+                try:
+                    count = generate_variants(getattr(obj, field))
+                except (InvalidImage, FileNotFoundError) as error:
+                    self.stderr.write(f'{obj._meta.label} {obj.pk}: {error}')
+                    continue
+                created += count
+                # В закэшированном ответе рецепта вместо вариантов
+                # были ссылки на оригинал
+                if count and isinstance(obj, Recipe):
+                    invalidate_recipe_representations([obj.id])
+        self.stdout.write(self.style.SUCCESS(f'Создано файлов: {created}'))
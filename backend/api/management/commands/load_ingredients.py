@@ -0,0 +1,166 @@
+import csv
+import io
+import json
+import time
+from itertools import islice
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+
+from api.ingredient_index import invalidate as invalidate_ingredient_index
+from recipes.models import Ingredient
+
+DEFAULT_PATH = settings.BASE_DIR.parent / 'data' / 'ingredients.csv'
+JSON_READ_SIZE = 64 * 1024
+
+
+def iter_csv(file):
+    for row in csv.reader(file):
+        if len(row) >= 2:
+            yield row[0], row[1]
+
+
+def iter_json(file):
+    # Читает массив объектов кусками, не загружая файл целиком
+    decoder = json.JSONDecoder()
+    buffer = ''
+    opened = eof = False
+    while True:
+        if not eof:
+            chunk = file.read(JSON_READ_SIZE)
+            eof = not chunk
+            buffer += chunk
+        position = 0
+        while True:
+            while position < len(buffer) and buffer[position] in ' \t\r\n,':
+                position += 1
+            if position == len(buffer):
+                break
+            if not opened:
+                if buffer[position] != '[':
+                    raise CommandError('Ожидается JSON-массив ингредиентов')
+                opened = True
+                position += 1
+                continue
+            if buffer[position] == ']':
+                return
+            try:
+                item, position = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError:
+                # Объект не дочитан, ждём следующий кусок файла
+                break
+            try:
+                yield item['name'], item['measurement_unit']
+            except (KeyError, TypeError):
+                raise CommandError(f'Некорректный ингредиент: {item}')
+        buffer = buffer[position:]
+        if eof:
+            if opened or buffer.strip():
+                raise CommandError('JSON-массив ингредиентов не завершён')
+            return
+
+
+def chunked(rows, size):
+    rows = iter(rows)
+    while chunk := list(islice(rows, size)):
+        yield chunk
+
+
+class Command(BaseCommand):
+    help = 'Загружает ингредиенты из CSV или JSON файла'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', nargs='?', default=str(DEFAULT_PATH))
+        parser.add_argument(
+            '--format', choices=('csv', 'json'),
+            help='Формат файла, по умолчанию определяется по расширению',
+        )
+        parser.add_argument('--chunk-size', type=int, default=5000)
+        parser.add_argument(
+            '--method', choices=('auto', 'bulk', 'copy'), default='auto',
+            help='copy доступен только для PostgreSQL',
+        )
+
+    def handle(self, *args, **options):
+        self.verbosity = options['verbosity']
+        path = Path(options['path'])
+        if not path.is_file():
+            raise CommandError(f'Файл {path} не найден')
+        file_format = options['format'] or path.suffix.lstrip('.').lower()
+        if file_format not in ('csv', 'json'):
+            raise CommandError('Поддерживаются только csv и json')
+        method = options['method']
+        if method == 'auto':
+            method = 'copy' if connection.vendor == 'postgresql' else 'bulk'
+        elif method == 'copy' and connection.vendor != 'postgresql':
+            raise CommandError('COPY поддерживается только в PostgreSQL')
+
+        started = time.monotonic()
+        count_before = Ingredient.objects.count()
+        with path.open(encoding='utf-8', newline='') as file:
+            rows = iter_csv(file) if file_format == 'csv' else iter_json(file)
+            rows = (
+                (name.strip(), unit.strip()) for name, unit in rows
+                if name.strip() and unit.strip()
+            )
+            with transaction.atomic():
+                if method == 'copy':
+                    read = self.load_with_copy(rows, options['chunk_size'])
+                else:
+                    read = self.load_with_bulk_create(
+                        rows, options['chunk_size']
+                    )
+        created = Ingredient.objects.count() - count_before
+        invalidate_ingredient_index()
+
+        elapsed = time.monotonic() - started
+        self.stdout.write(self.style.SUCCESS(
+            f'Прочитано строк: {read}, добавлено ингредиентов: {created} '
+            f'за {elapsed:.2f} с ({read / max(elapsed, 1e-6):.0f} строк/с)'
+        ))
+
+    def load_with_bulk_create(self, rows, chunk_size):
+        read = 0
+        for chunk in chunked(rows, chunk_size):
+            read += len(chunk)
+            Ingredient.objects.bulk_create(
+                [
+                    Ingredient(name=name, measurement_unit=unit)
+                    for name, unit in dict.fromkeys(chunk)
+                ],
+                ignore_conflicts=True,
+            )
+            self.report_progress(read)
+        return read
+
+    def load_with_copy(self, rows, chunk_size):
+        table = Ingredient._meta.db_table
+        read = 0
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'CREATE TEMP TABLE ingredient_load '
+                '(name varchar, measurement_unit varchar) ON COMMIT DROP'
+            )
+            for chunk in chunked(rows, chunk_size):
+                read += len(chunk)
+                buffer = io.StringIO()
+                csv.writer(buffer).writerows(chunk)
+                buffer.seek(0)
+                cursor.copy_expert(
+                    'COPY ingredient_load FROM STDIN WITH (FORMAT csv)',
+                    buffer,
+                )
+                self.report_progress(read)
+            cursor.execute(
+                f'INSERT INTO {table} (name, measurement_unit, updated_at) '
+                'SELECT DISTINCT name, measurement_unit, now() '
+                'FROM ingredient_load '
+                'ON CONFLICT (name, measurement_unit) DO NOTHING'
+            )
+        return read
+
+    def report_progress(self, read):
+        if self.verbosity > 1:
+            self.stdout.write(f'Обработано строк: {read}')
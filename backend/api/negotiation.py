@@ -0,0 +1,9 @@
+from rest_framework.negotiation import DefaultContentNegotiation
+
+
+class IgnoreFormatContentNegotiation(DefaultContentNegotiation):
+    """Не выбирает рендерер по ?format=, когда параметр нужен самому
+    представлению (например, формат выгружаемого файла)."""
+
+    def select_renderer(self, request, renderers, format_suffix=None):
+        return renderers[0], renderers[0].media_type
@@ -1,6 +1,111 @@
-from rest_framework.pagination import PageNumberPagination
+import hashlib
+
+from django.core.cache import cache
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import QuerySet
+from django.utils.functional import cached_property
+from rest_framework.pagination import CursorPagination, PageNumberPagination
+
+COUNT_GENERATION_CACHE_KEY = 'pagination-count-generation'
+COUNT_CACHE_TIMEOUT = 30
+# С какого размера таблицы в PostgreSQL для выборки без фильтров
+# берётся оценка планировщика вместо точного COUNT(*)
+ESTIMATED_COUNT_THRESHOLD = 100_000
+
+
+def invalidate_counts():
+    # Новое поколение делает все закэшированные количества устаревшими
+    try:
+        cache.incr(COUNT_GENERATION_CACHE_KEY)
+    except ValueError:
+        cache.set(COUNT_GENERATION_CACHE_KEY, 1, timeout=None)
+
+
+def estimated_count(queryset):
+    connection = connections[queryset.db]
+    if connection.vendor != 'postgresql' or queryset.query.where:
+        return None
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass',
+            [queryset.model._meta.db_table],
+        )
+        row = cursor.fetchone()
+    if row and row[0] >= ESTIMATED_COUNT_THRESHOLD:
+        return row[0]
+    return None
+
+
+class CachedCountPaginator(Paginator):
+    """Кэширует количество объектов по SQL выборки (он включает фильтры
+    и пользователя) на короткое время; записи в рецепты, избранное,
+    корзины и подписки сбрасывают кэш через invalidate_counts."""
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        if not isinstance(queryset, QuerySet):
+            return super().count
+        if queryset.query.is_empty():
+            return 0
+        generation = cache.get_or_set(
+            COUNT_GENERATION_CACHE_KEY, 1, timeout=None
+        )
+        # Хешируется шаблон SQL и параметры, а не SQL с подставленными
+        # значениями: его сборка для длинных списков id дороже запроса
+        sql, params = queryset.query.get_compiler(queryset.db).as_sql()
+        signature = hashlib.sha1(
+            f'{queryset.db}:{sql}:{params!r}'.encode()
+        ).hexdigest()
+        key = f'pagination-count:{generation}:{signature}'
+        count = cache.get(key)
+        if count is None:
+            count = estimated_count(queryset)
+            if count is None:
+                count = queryset.count()
+            cache.set(key, count, COUNT_CACHE_TIMEOUT)
+        return count
+
+
+class KeysetPaginator(CursorPagination):
+    """Курсорная пагинация по полям сортировки выборки: стоимость любой
+    страницы та же, что и первой, без COUNT(*) и OFFSET."""
+    page_size_query_param = 'limit'
+    max_page_size = 100
+
+    def get_ordering(self, request, queryset, view):
+        return tuple(
+            queryset.query.order_by
+            or queryset.model._meta.ordering
+            or ('pk',)
+        )
+
 
 class CommonPaginator(PageNumberPagination):
+    django_paginator_class = CachedCountPaginator
     page_size_query_param = 'limit'
     page_query_param = 'page'
     max_page_size = 100
+    # Курсорный режим включается параметром cursor (пустым для первой
+    # страницы), ссылки next/previous в ответе уже содержат курсор
+    cursor_query_param = 'cursor'
+    keyset_paginator = None
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if self.cursor_query_param in request.query_params:
+            self.keyset_paginator = KeysetPaginator()
+            return self.keyset_paginator.paginate_queryset(
+                queryset, request, view
+            )
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        if self.keyset_paginator is not None:
+            return self.keyset_paginator.get_paginated_response(data)
+        return super().get_paginated_response(data)
+
+    def to_html(self):
+        if self.keyset_paginator is not None:
+            return self.keyset_paginator.to_html()
+        return super().to_html()
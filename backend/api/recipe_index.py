@@ -0,0 +1,252 @@
+import bisect
+import threading
+from array import array
+from collections import Counter
+from itertools import repeat
+
+from django.core.cache import cache
+from django.db import transaction
+
+from recipes.models import IngredientRecipe
+
+GENERATION_CACHE_KEY = 'recipe-ingredient-index-generation'
+CHANGE_CACHE_TIMEOUT = 60 * 60
+# Если процесс отстал на большее число изменений, индекс строится заново
+MAX_REPLAYED_CHANGES = 1000
+PUBLISH_ATTEMPTS = 5
+EMPTY = array('I')
+# Изменения текущей транзакции потока, ещё не опубликованные
+pending = threading.local()
+
+
+def change_cache_key(generation):
+    return f'recipe-ingredient-index-change:{generation}'
+
+
+class RecipeIngredientIndex:
+    """Инвертированный индекс «ингредиент → рецепты» в памяти процесса.
+
+    Строится лениво. Изменения состава рецептов нумеруются в кэше
+    (см. record_change), и процесс перечитывает из базы только
+    изменившиеся рецепты.
+
+    Списки рецептов ингредиентов хранятся отсортированными массивами
+    array('I'), состав рецептов — одним массивом ingredients со смещениями
+    offsets по id рецепта (4 байта на строку IngredientRecipe). Рецепты,
+    изменённые после построения, лежат в changed_recipes до следующей
+    полной перестройки."""
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.generation = None
+        self.postings = None
+        self.offsets = array('I', [0])
+        self.ingredients = array('I')
+        self.changed_recipes = {}
+
+    def build(self, generation):
+        postings = {}
+        # Ингредиенты рецепта id лежат в ingredients[offsets[id]:offsets[id + 1]]
+        offsets = array('I', [0])
+        ingredients = array('I')
+        rows = (
+            IngredientRecipe.objects
+            .filter(recipe__isnull=False)
+            .order_by('recipe_id', 'ingredient_id')
+            .values_list('recipe_id', 'ingredient_id')
+            .iterator(chunk_size=10000)
+        )
+        # Строки идут по возрастанию id рецепта, поэтому списки рецептов
+        # ингредиентов получаются отсортированными без сортировки
+        for recipe_id, ingredient_id in rows:
+            if len(offsets) < recipe_id + 2:
+                offsets.extend(
+                    repeat(len(ingredients), recipe_id + 2 - len(offsets))
+                )
+            elif ingredients and offsets[recipe_id + 1] > offsets[recipe_id] \
+                    and ingredients[-1] == ingredient_id:
+                # Ингредиент указан в рецепте дважды
+                continue
+            ingredients.append(ingredient_id)
+            offsets[recipe_id + 1] = len(ingredients)
+            posting = postings.get(ingredient_id)
+            if posting is None:
+                posting = postings[ingredient_id] = array('I')
+            posting.append(recipe_id)
+        self.postings = postings
+        self.offsets = offsets
+        self.ingredients = ingredients
+        self.changed_recipes = {}
+        self.generation = generation
+
+    def recipe_ingredients(self, recipe_id):
+        ingredients = self.changed_recipes.get(recipe_id)
+        if ingredients is not None:
+            return ingredients
+        if recipe_id + 1 >= len(self.offsets):
+            return ()
+        return self.ingredients[
+            self.offsets[recipe_id]:self.offsets[recipe_id + 1]
+        ]
+
+    def ingredient_count(self, recipe_id):
+        ingredients = self.changed_recipes.get(recipe_id)
+        if ingredients is not None:
+            return len(ingredients)
+        if recipe_id + 1 >= len(self.offsets):
+            return 0
+        return self.offsets[recipe_id + 1] - self.offsets[recipe_id]
+
+    def refresh(self, recipe_ids):
+        # Перечитывает состав только указанных рецептов
+        for recipe_id in recipe_ids:
+            for ingredient_id in self.recipe_ingredients(recipe_id):
+                posting = self.postings[ingredient_id]
+                position = bisect.bisect_left(posting, recipe_id)
+                if position < len(posting) and posting[position] == recipe_id:
+                    del posting[position]
+        changed = {recipe_id: set() for recipe_id in recipe_ids}
+        rows = IngredientRecipe.objects.filter(
+            recipe_id__in=recipe_ids
+        ).values_list('recipe_id', 'ingredient_id')
+        for recipe_id, ingredient_id in rows:
+            changed[recipe_id].add(ingredient_id)
+        for recipe_id, ingredient_ids in changed.items():
+            self.changed_recipes[recipe_id] = array(
+                'I', sorted(ingredient_ids)
+            )
+            for ingredient_id in ingredient_ids:
+                bisect.insort(
+                    self.postings.setdefault(ingredient_id, array('I')),
+                    recipe_id,
+                )
+
+    def ensure_fresh(self):
+        generation = cache.get(GENERATION_CACHE_KEY)
+        if self.postings is not None and generation == self.generation:
+            return
+        with self.lock:
+            if self.postings is not None and generation == self.generation:
+                return
+            changes = self.pending_changes(generation)
+            if changes is None:
+                self.build(generation)
+                return
+            self.refresh(set().union(*changes))
+            self.generation = generation
+
+    def pending_changes(self, generation):
+        """Списки рецептов, изменённых после построения индекса,
+        или None, если их не восстановить и нужна полная перестройка."""
+        if (
+            self.postings is None
+            or generation is None
+            or self.generation is None
+            or not 0 < generation - self.generation <= MAX_REPLAYED_CHANGES
+        ):
+            return None
+        keys = [
+            change_cache_key(number)
+            for number in range(self.generation + 1, generation + 1)
+        ]
+        changes = cache.get_many(keys)
+        if len(changes) != len(keys):
+            return None
+        return changes.values()
+
+    def get_postings(self, ingredient_ids):
+        return [
+            self.postings.get(ingredient_id, EMPTY)
+            for ingredient_id in ingredient_ids
+        ]
+
+    def with_all(self, ingredient_ids):
+        """Рецепты, в которых есть все указанные ингредиенты."""
+        self.ensure_fresh()
+        with self.lock:
+            postings = sorted(self.get_postings(ingredient_ids), key=len)
+            if not postings:
+                return set()
+            # Пересечение начинаем с самого короткого списка, остальные
+            # проверяем двоичным поиском, не разворачивая в множества
+            result = set(postings[0])
+            for posting in postings[1:]:
+                if not result:
+                    break
+                result = {
+                    recipe_id for recipe_id in result
+                    if contains(posting, recipe_id)
+                }
+            return result
+
+    def with_any(self, ingredient_ids):
+        """Рецепты, в которых есть хотя бы один из ингредиентов."""
+        self.ensure_fresh()
+        with self.lock:
+            return set().union(*self.get_postings(ingredient_ids))
+
+    def with_only(self, ingredient_ids):
+        """Рецепты, которые можно приготовить только из указанных
+        ингредиентов."""
+        self.ensure_fresh()
+        with self.lock:
+            # Рецепт подходит, если все его ингредиенты нашлись среди
+            # указанных: число совпадений равно размеру состава
+            matches = Counter()
+            for posting in self.get_postings(set(ingredient_ids)):
+                matches.update(posting)
+            return {
+                recipe_id for recipe_id, count in matches.items()
+                if count == self.ingredient_count(recipe_id)
+            }
+
+
+def contains(posting, recipe_id):
+    position = bisect.bisect_left(posting, recipe_id)
+    return position < len(posting) and posting[position] == recipe_id
+
+
+def publish_change(recipe_ids):
+    # incr не во всех бэкендах атомарен: номер изменения считается
+    # занятым, только если удалось добавить запись с этим номером
+    for _ in range(PUBLISH_ATTEMPTS):
+        try:
+            generation = cache.incr(GENERATION_CACHE_KEY)
+        except ValueError:
+            # Счётчика нет в кэше: процессы перестроят индекс целиком
+            cache.set(GENERATION_CACHE_KEY, 1, timeout=None)
+            return
+        if cache.add(
+            change_cache_key(generation), recipe_ids, CHANGE_CACHE_TIMEOUT
+        ):
+            return
+    cache.delete(GENERATION_CACHE_KEY)
+
+
+def record_change(recipe_ids):
+    """Сообщает всем процессам, что состав рецептов изменился.
+
+    Запись делается после коммита, чтобы индекс прочитал новые строки.
+    Изменения одной транзакции собираются и публикуются одним номером:
+    сигналы строк IngredientRecipe не расходуют номер на каждую строку."""
+    connection = transaction.get_connection()
+    if not connection.in_atomic_block:
+        publish_change(sorted(set(recipe_ids)))
+        return
+    batch = getattr(pending, 'batch', None)
+    # После коммита или отката (в том числе точки сохранения, в которой
+    # была зарегистрирована публикация) собирается новая пачка
+    if batch is None or not any(
+        entry[1] is batch[0] for entry in connection.run_on_commit
+    ):
+        batch_ids = set()
+
+        def publish():
+            publish_change(sorted(batch_ids))
+
+        batch = pending.batch = (publish, batch_ids)
+        transaction.on_commit(publish)
+    batch[1].update(recipe_ids)
+
+
+recipe_index = RecipeIngredientIndex()
@@ -0,0 +1,285 @@
+from django.db import connections, transaction
+from django.db.models.constants import OnConflict
+from rest_framework import status
+
+from api.pagination import invalidate_counts
+from recipes.models import Recipe
+from users import counters, shopping_list
+from users.models import Favorite, Follow, ShoppingCart
+
+# Связи пользователя с объектами: модель связи → поле объекта
+TARGET_FIELDS = {
+    Favorite: 'recipe',
+    ShoppingCart: 'recipe',
+    Follow: 'following',
+}
+# Поля рецепта в ответе на добавление в избранное и корзину
+RECIPE_SUMMARY_FIELDS = ('id', 'name', 'image', 'cooking_time')
+
+
+def target_column(model):
+    return model._meta.get_field(TARGET_FIELDS[model]).column
+
+
+def quoted_names(model, connection):
+    quote = connection.ops.quote_name
+    target = model._meta.get_field(TARGET_FIELDS[model])
+    return {
+        'table': quote(model._meta.db_table),
+        'user': quote(model._meta.get_field('user').column),
+        'target': quote(target.column),
+        'target_table': quote(target.related_model._meta.db_table),
+        'target_pk': quote(target.related_model._meta.pk.column),
+    }
+
+
+def placeholders(values):
+    return ', '.join(['%s'] * len(values))
+
+
+def existing(model, user_id, target_ids):
+    """Id объектов из target_ids, с которыми пользователь уже связан."""
+    column = target_column(model)
+    return set(
+        model.objects
+        .filter(user_id=user_id, **{f'{column}__in': target_ids})
+        .values_list(column, flat=True)
+    )
+
+
+def insert(model, user_id, target_ids):
+    """Связывает пользователя с существующими объектами из target_ids
+    одним INSERT, уже существующие связи пропускаются по уникальному
+    ограничению. Возвращает id объектов, связи с которыми созданы."""
+    if not target_ids:
+        return []
+    connection = connections[model.objects.db]
+    ops = connection.ops
+    names = quoted_names(model, connection)
+    # INSERT ... SELECT не даёт сослаться на несуществующий объект
+    sql = (
+        f'{ops.insert_statement(on_conflict=OnConflict.IGNORE)} '
+        f'{names["table"]} ({names["user"]}, {names["target"]}) '
+        f'SELECT %s, {names["target_pk"]} FROM {names["target_table"]} '
+        f'WHERE {names["target_pk"]} IN ({placeholders(target_ids)}) '
+        f'{ops.on_conflict_suffix_sql([], OnConflict.IGNORE, None, None)}'
+    )
+    params = [user_id, *target_ids]
+    with connection.cursor() as cursor:
+        if connection.features.can_return_columns_from_insert:
+            cursor.execute(f'{sql} RETURNING {names["target"]}', params)
+            return [row[0] for row in cursor.fetchall()]
+        before = existing(model, user_id, target_ids)
+        cursor.execute(sql, params)
+    after = existing(model, user_id, target_ids)
+    return [target_id for target_id in target_ids
+            if target_id in after and target_id not in before]
+
+
+def delete(model, user_id, target_ids):
+    """Удаляет связи пользователя с объектами одним DELETE.
+    Возвращает id объектов, связи с которыми действительно были."""
+    if not target_ids:
+        return []
+    connection = connections[model.objects.db]
+    names = quoted_names(model, connection)
+    sql = (
+        f'DELETE FROM {names["table"]} WHERE {names["user"]} = %s '
+        f'AND {names["target"]} IN ({placeholders(target_ids)})'
+    )
+    params = [user_id, *target_ids]
+    with connection.cursor() as cursor:
+        if connection.features.can_return_columns_from_insert:
+            # СУБД с RETURNING сразу сообщают, что было удалено
+            cursor.execute(f'{sql} RETURNING {names["target"]}', params)
+            return [row[0] for row in cursor.fetchall()]
+        removed = list(existing(model, user_id, target_ids))
+        cursor.execute(sql, params)
+    return removed
+
+
+def add(model, user_id, target_ids):
+    # savepoint=False: внутри транзакции вызывающего не нужны
+    # лишние SAVEPOINT на каждый вызов
+    with transaction.atomic(savepoint=False):
+        added = insert(model, user_id, target_ids)
+        relations_changed(model, user_id, added, 1)
+    return added
+
+
+def remove(model, user_id, target_ids):
+    with transaction.atomic(savepoint=False):
+        removed = delete(model, user_id, target_ids)
+        relations_changed(model, user_id, removed, -1)
+    return removed
+
+
+def relations_changed(model, user_id, target_ids, delta, counted=False):
+    # Запросы в обход ORM не отправляют сигналы моделей,
+    # поэтому производные данные обновляются здесь.
+    # counted — счётчики уже изменены тем же запросом
+    if not target_ids:
+        return
+    if counted:
+        pass
+    elif model is Follow:
+        counters.follows_changed(user_id, target_ids, delta)
+    else:
+        counters.recipe_relations_changed(model, target_ids, delta)
+    if model is ShoppingCart:
+        if delta > 0:
+            shopping_list.add_recipes(user_id, target_ids)
+        else:
+            shopping_list.remove_recipes(user_id, target_ids)
+    transaction.on_commit(invalidate_counts)
+
+
+def recipe_counter_sql(model, connection, names, changed, delta):
+    # Часть WITH, меняющая счётчик рецепта по строкам из changed
+    counter = connection.ops.quote_name(
+        counters.RECIPE_RELATION_COUNTERS[model.__name__]
+    )
+    return (
+        f'counted AS ('
+        f'UPDATE {names["target_table"]} '
+        f'SET {counter} = GREATEST({counter} + {int(delta)}, 0) '
+        f'WHERE {names["target_pk"]} IN '
+        f'(SELECT {names["target"]} FROM {changed})'
+        f')'
+    )
+
+
+def add_recipe(model, user_id, recipe_id):
+    """Добавляет рецепт в избранное или корзину (model) пользователя.
+    Возвращает (рецепт или None, если его нет; добавлен ли он сейчас)."""
+    connection = connections[model.objects.db]
+    if connection.vendor != 'postgresql':
+        recipe = (
+            Recipe.objects.only(*RECIPE_SUMMARY_FIELDS)
+            .filter(id=recipe_id).first()
+        )
+        if recipe is None:
+            return None, False
+        return recipe, bool(add(model, user_id, [recipe_id]))
+    # Поиск рецепта, вставка связи и счётчик — один запрос
+    names = quoted_names(model, connection)
+    columns = ', '.join(
+        connection.ops.quote_name(Recipe._meta.get_field(field).column)
+        for field in RECIPE_SUMMARY_FIELDS
+    )
+    counted = recipe_counter_sql(model, connection, names, 'inserted', 1)
+    with transaction.atomic(savepoint=False):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'WITH target AS ('
+                f'SELECT {columns} FROM {names["target_table"]} '
+                f'WHERE {names["target_pk"]} = %s'
+                f'), inserted AS ('
+                f'INSERT INTO {names["table"]} '
+                f'({names["user"]}, {names["target"]}) '
+                f'SELECT %s, {names["target_pk"]} FROM target '
+                f'ON CONFLICT DO NOTHING RETURNING {names["target"]}'
+                f'), {counted} '
+                f'SELECT {columns}, EXISTS(SELECT 1 FROM inserted) '
+                f'FROM target',
+                [recipe_id, user_id],
+            )
+            row = cursor.fetchone()
+        if row is None:
+            return None, False
+        *values, created = row
+        if created:
+            relations_changed(
+                model, user_id, [recipe_id], 1, counted=True
+            )
+    recipe = Recipe.from_db(
+        connection.alias, RECIPE_SUMMARY_FIELDS, values
+    )
+    return recipe, created
+
+
+def remove_recipe(model, user_id, recipe_id):
+    """Убирает рецепт из избранного или корзины (model) пользователя.
+    Возвращает (есть ли такой рецепт, был ли он там)."""
+    connection = connections[model.objects.db]
+    if connection.vendor != 'postgresql':
+        if remove(model, user_id, [recipe_id]):
+            return True, True
+        return Recipe.objects.filter(id=recipe_id).exists(), False
+    # Поиск рецепта, удаление связи и счётчик — один запрос
+    names = quoted_names(model, connection)
+    counted = recipe_counter_sql(model, connection, names, 'deleted', -1)
+    with transaction.atomic(savepoint=False):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'WITH target AS ('
+                f'SELECT {names["target_pk"]} FROM {names["target_table"]} '
+                f'WHERE {names["target_pk"]} = %s'
+                f'), deleted AS ('
+                f'DELETE FROM {names["table"]} WHERE {names["user"]} = %s '
+                f'AND {names["target"]} IN '
+                f'(SELECT {names["target_pk"]} FROM target) '
+                f'RETURNING {names["target"]}'
+                f'), {counted} '
+                f'SELECT EXISTS(SELECT 1 FROM deleted) FROM target',
+                [recipe_id, user_id],
+            )
+            row = cursor.fetchone()
+        if row is None:
+            return False, False
+        removed = row[0]
+        if removed:
+            relations_changed(model, user_id, [recipe_id], -1, counted=True)
+    return True, removed
+
+
+def apply_bulk(model, user_id, target_ids, found_ids, adding, messages):
+    """Добавляет или удаляет связи пользователя с объектами target_ids
+    и возвращает результат для каждого объекта в том же виде, в каком
+    его вернул бы запрос для одного объекта.
+
+    found_ids — id существующих объектов, messages — тексты ошибок
+    по ключам not_found, exists, missing и self."""
+    related = existing(model, user_id, target_ids)
+    results, changed = {}, []
+    for target_id in target_ids:
+        if target_id not in found_ids:
+            results[target_id] = (
+                status.HTTP_404_NOT_FOUND, messages['not_found']
+            )
+        elif adding and model is Follow and target_id == user_id:
+            results[target_id] = (
+                status.HTTP_400_BAD_REQUEST, messages['self']
+            )
+        elif adding and target_id in related:
+            results[target_id] = (
+                status.HTTP_400_BAD_REQUEST, messages['exists']
+            )
+        elif not adding and target_id not in related:
+            results[target_id] = (
+                status.HTTP_400_BAD_REQUEST, messages['missing']
+            )
+        else:
+            changed.append(target_id)
+    if adding:
+        changed = add(model, user_id, changed)
+        done = status.HTTP_201_CREATED
+    else:
+        changed = remove(model, user_id, changed)
+        done = status.HTTP_204_NO_CONTENT
+    for target_id in changed:
+        results[target_id] = (done, None)
+    # Связь могла появиться или исчезнуть параллельным запросом
+    # после проверки: INSERT и DELETE сообщают, что сделали на самом деле
+    conflict = (
+        status.HTTP_400_BAD_REQUEST,
+        messages['exists' if adding else 'missing'],
+    )
+    response = []
+    for target_id in target_ids:
+        code, detail = results.get(target_id, conflict)
+        item = {'id': target_id, 'status': code}
+        if detail:
+            item['detail'] = detail
+        response.append(item)
+    return response
@@ -1,13 +1,49 @@
+import json
+
 from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Prefetch, prefetch_related_objects
+from django.http import QueryDict
+from django.utils.functional import cached_property
 from rest_framework import serializers
 from djoser.serializers import UserCreateSerializer as DjoserUserCreateSerializer
+from users import shopping_list
 from users.models import Follow, Favorite, ShoppingCart
 from recipes.models import Ingredient, Recipe, IngredientRecipe
 
 from api.fields import Binary64ImageField
+from api.images import variant_urls
+from api.recipe_index import record_change as record_recipe_index_change
 
 User = get_user_model()
 
+RECIPE_REPRESENTATION_TIMEOUT = 60 * 60 * 24
+BULK_MAX_IDS = 100
+
+
+def recipe_representation_key(recipe_id):
+    return f'recipe-representation:{recipe_id}'
+
+
+def invalidate_recipe_representations(recipe_ids):
+    cache.delete_many([
+        recipe_representation_key(recipe_id) for recipe_id in recipe_ids
+    ])
+
+
+def get_following_ids(request):
+    # Id авторов, на которых подписан текущий пользователь.
+    # Загружаются один раз и переиспользуются всеми сериализаторами запроса
+    following_ids = getattr(request, '_following_ids', None)
+    if following_ids is None:
+        following_ids = set(
+            Follow.objects.filter(user=request.user)
+            .values_list('following_id', flat=True)
+        )
+        request._following_ids = following_ids
+    return following_ids
+
 
 class UserSerializer(serializers.ModelSerializer):
     is_subscribed = serializers.SerializerMethodField()
@@ -18,12 +54,10 @@ class UserSerializer(serializers.ModelSerializer):
         fields = ('id', 'username', 'email', 'first_name', 'last_name', 'is_subscribed', 'avatar')
 
     def get_is_subscribed(self, obj):
-        user = self.context.get('request').user
-        if user.is_anonymous:
+        request = self.context.get('request')
+        if request is None or request.user.is_anonymous:
             return False
-        return Follow.objects.filter(
-            user=user, following=obj
-        ).exists()
+        return obj.id in get_following_ids(request)
 
     def get_avatar(self, obj):
         if obj.avatar:
@@ -59,7 +93,9 @@ class UserAvatarSerializer(serializers.ModelSerializer):
 
 
 class RecipeIngredientSerializer(serializers.ModelSerializer):
-    id = serializers.PrimaryKeyRelatedField(queryset=Ingredient.objects.all())
+    # Существование ингредиентов проверяет CreateRecipeSerializer
+    # одним запросом на весь список
+    id = serializers.IntegerField()
     amount = serializers.IntegerField(min_value=1)
 
     class Meta:
@@ -82,6 +118,39 @@ class CreateRecipeSerializer(serializers.ModelSerializer):
             "cooking_time",
         )
 
+    def to_internal_value(self, data):
+        # В multipart/form-data изображение приходит файлом,
+        # а список ингредиентов — JSON-строкой
+        if isinstance(data, QueryDict):
+            data = data.dict()
+            if isinstance(data.get("ingredients"), str):
+                try:
+                    data["ingredients"] = json.loads(data["ingredients"])
+                except ValueError:
+                    raise serializers.ValidationError(
+                        {"ingredients": ["Ожидается JSON-список ингредиентов"]}
+                    )
+        return super().to_internal_value(data)
+
+    def validate_ingredients(self, ingredients):
+        ingredient_ids = {ingredient["id"] for ingredient in ingredients}
+        found_ids = set(
+            Ingredient.objects.filter(id__in=ingredient_ids)
+            .values_list("id", flat=True)
+        )
+        if found_ids == ingredient_ids:
+            return ingredients
+        message = serializers.PrimaryKeyRelatedField.default_error_messages[
+            "does_not_exist"
+        ]
+        # Ошибки в том же виде, что и у вложенного сериализатора
+        raise serializers.ValidationError([
+            {}
+            if ingredient["id"] in found_ids
+            else {"id": [message.format(pk_value=ingredient["id"])]}
+            for ingredient in ingredients
+        ])
+
     def validate(self, data):
         ingredients = data.get("recipe_ingredients")
 
@@ -102,39 +171,44 @@ class CreateRecipeSerializer(serializers.ModelSerializer):
             )
         return data
 
+    @transaction.atomic
     def create(self, validated_data):
         ingredients_data = validated_data.pop('recipe_ingredients')
         validated_data['author'] = self.context['request'].user
         recipe = Recipe.objects.create(**validated_data)
-
-        for ingredient_data in ingredients_data:
-            IngredientRecipe.objects.create(
-                recipe=recipe,
-                ingredient=ingredient_data['id'],
-                amount=ingredient_data['amount']
-            )
+        self.create_ingredients(ingredients_data, recipe)
 
         return recipe
 
+    @transaction.atomic
     def update(self, instance, validated_data):
         IngredientRecipe.objects.filter(recipe=instance).delete()
 
         ingredients_data = validated_data.pop('recipe_ingredients', [])
         self.create_ingredients(ingredients_data, instance)
+        shopping_list.refresh_recipe(instance.id)
 
         return super().update(instance, validated_data)
 
     def create_ingredients(self, ingredients_data, recipe):
         IngredientRecipe.objects.bulk_create([
             IngredientRecipe(
-                ingredient_id=ingredient_data['id'].id,  # Явно указываем ID ингредиента
+                ingredient_id=ingredient_data['id'],
                 recipe=recipe,
                 amount=ingredient_data['amount']
             )
             for ingredient_data in ingredients_data
         ])
+        # bulk_create не отправляет сигналы, индекс ингредиентов
+        # рецептов нужно уведомить явно
+        record_recipe_index_change([recipe.id])
 
     def to_representation(self, instance):
+        # Ингредиенты для ответа загружаются одним запросом, а не по одному
+        prefetch_related_objects([instance], Prefetch(
+            'recipe_ingredients',
+            queryset=IngredientRecipe.objects.select_related('ingredient'),
+        ))
         return RecipeSerializer(instance, context=self.context).data
 
 
@@ -143,6 +217,7 @@ class RecipeSerializer(serializers.ModelSerializer):
     ingredients = serializers.SerializerMethodField()
     is_favorited = serializers.SerializerMethodField()
     is_in_shopping_cart = serializers.SerializerMethodField()
+    image_variants = serializers.SerializerMethodField()
 
     class Meta:
         model = Recipe
@@ -154,10 +229,51 @@ class RecipeSerializer(serializers.ModelSerializer):
             "is_in_shopping_cart",
             "name",
             "image",
+            "image_variants",
             "text",
             "cooking_time",
         )
 
+    def to_representation(self, instance):
+        # Общая для всех часть ответа берётся из кэша, поверх неё
+        # подставляются только флаги текущего пользователя
+        request = self.context.get("request")
+        data = self.get_shared_representation(instance)
+        author = dict(data["author"])
+        author["is_subscribed"] = (
+            request is not None
+            and request.user.is_authenticated
+            and instance.author_id in get_following_ids(request)
+        )
+        data = dict(data)
+        data["author"] = author
+        data["is_favorited"] = self.get_is_favorited(instance)
+        data["is_in_shopping_cart"] = self.get_is_in_shopping_cart(instance)
+        return data
+
+    @cached_property
+    def base_url(self):
+        request = self.context.get("request")
+        return request.build_absolute_uri('/') if request else ''
+
+    def get_shared_representation(self, instance):
+        # Запись кэша: (updated_at рецепта, {базовый URL: представление}),
+        # URL нужен, так как ссылки на изображения абсолютные
+        key = recipe_representation_key(instance.id)
+        updated_at, representations = cache.get(key, (None, {}))
+        if updated_at != instance.updated_at:
+            representations = {}
+        data = representations.get(self.base_url)
+        if data is None:
+            data = super().to_representation(instance)
+            representations[self.base_url] = data
+            cache.set(
+                key,
+                (instance.updated_at, representations),
+                RECIPE_REPRESENTATION_TIMEOUT,
+            )
+        return data
+
     def get_ingredients(self, obj):
         ingredients = obj.recipe_ingredients.all()
         return [
@@ -170,22 +286,42 @@ class RecipeSerializer(serializers.ModelSerializer):
             for item in ingredients
         ]
 
-    def get_is_favorited(self, obj):
+    def get_image_variants(self, obj):
+        # Уменьшенные копии изображения для списков: {размер: {формат: url}}
         request = self.context.get("request")
+        variants = variant_urls(obj.image)
+        if request is None:
+            return variants
+        return {
+            size: {
+                ext: request.build_absolute_uri(url)
+                for ext, url in urls.items()
+            }
+            for size, urls in variants.items()
+        }
 
-        return (
-                request is not None
-                and request.user.is_authenticated
-                and request.user.favorites.filter(pk=obj.id).exists()
-        )
+    def get_is_favorited(self, obj):
+        return self.get_user_relation_flag(obj, "is_favorited", "favorites")
 
     def get_is_in_shopping_cart(self, obj):
+        return self.get_user_relation_flag(
+            obj, "is_in_shopping_cart", "shopping_carts"
+        )
+
+    def get_user_relation_flag(self, obj, annotation, related_name):
+        # RecipeViewSet аннотирует флаги сразу для всей выборки,
+        # запрос делаем только для неаннотированных объектов
+        if hasattr(obj, annotation):
+            return getattr(obj, annotation)
+
         request = self.context.get("request")
 
         return (
                 request is not None
                 and request.user.is_authenticated
-                and request.user.shopping_carts.filter(pk=obj.id).exists()
+                and getattr(request.user, related_name).filter(
+                    recipe_id=obj.id
+                ).exists()
         )
 
 
@@ -240,7 +376,7 @@ class FollowSerializer(serializers.ModelSerializer):
     last_name = serializers.ReadOnlyField(source='following.last_name')
     is_subscribed = serializers.SerializerMethodField()
     recipes = serializers.SerializerMethodField()
-    recipes_count = serializers.SerializerMethodField()
+    recipes_count = serializers.ReadOnlyField(source='following.recipes_count')
     avatar = serializers.SerializerMethodField()
 
     class Meta:
@@ -254,18 +390,31 @@ class FollowSerializer(serializers.ModelSerializer):
         return True
 
     def get_recipes(self, obj):
-        request = self.context.get('request')
-        recipes = obj.following.recipes.all()
-        limit = request.query_params.get('recipes_limit')
-        if limit and limit.isdigit():
-            recipes = recipes[:int(limit)]
+        # В списке подписок рецепты уже подгружены с учётом лимита
+        recipes = getattr(obj.following, 'limited_recipes', None)
+        if recipes is None:
+            request = self.context.get('request')
+            recipes = obj.following.recipes.all()
+            limit = request.query_params.get('recipes_limit')
+            if limit and limit.isdigit():
+                recipes = recipes[:int(limit)]
         return RecipeFromFavouritesSerializer(recipes, many=True).data
 
-    def get_recipes_count(self, obj):
-        return obj.following.recipes.count()
-
     def get_avatar(self, obj):
         if obj.following.avatar:
             request = self.context.get('request')
             return request.build_absolute_uri(obj.following.avatar.url)
-        return None
\ No newline at end of file
+        return None
+
+
+class BulkIdsSerializer(serializers.Serializer):
+    # Список id для массовых операций с избранным, корзиной и подписками
+    ids = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        allow_empty=False,
+        max_length=BULK_MAX_IDS,
+    )
+
+    def validate_ids(self, ids):
+        # Повторы обрабатываются один раз, порядок сохраняется
+        return list(dict.fromkeys(ids))
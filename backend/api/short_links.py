@@ -0,0 +1,170 @@
+import atexit
+import hashlib
+import string
+import threading
+import time
+from collections import Counter
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Case, F, PositiveIntegerField, Value, When
+
+from recipes.models import Recipe
+
+ALPHABET = string.digits + string.ascii_letters
+FEISTEL_ROUNDS = 4
+# Id до 2**32 кодируются не длиннее 6 символов, большие — ровно 11
+SHORT_CODE_BITS = 32
+LONG_CODE_BITS = 64
+LONG_CODE_LENGTH = 11
+RECIPE_EXISTS_TIMEOUT = 60 * 60 * 24
+RECIPE_MISSING_TIMEOUT = 60 * 5
+
+
+def round_value(key, round_number, value, bits):
+    digest = hashlib.blake2b(
+        f'{round_number}:{value}'.encode(),
+        key=key,
+        digest_size=bits // 16,
+    ).digest()
+    return int.from_bytes(digest, 'big')
+
+
+def feistel(value, bits, rounds):
+    # Сбалансированная сеть Фейстеля — биекция на [0, 2**bits)
+    half = bits // 2
+    mask = (1 << half) - 1
+    key = settings.SHORT_LINK_KEY.encode()[:64]
+    left, right = value >> half, value & mask
+    for round_number in rounds:
+        left, right = right, left ^ round_value(
+            key, round_number, right, bits
+        )
+    return (right << half) | left
+
+
+def to_base62(number, length=0):
+    chars = []
+    while number:
+        number, remainder = divmod(number, len(ALPHABET))
+        chars.append(ALPHABET[remainder])
+    return ''.join(reversed(chars)).rjust(max(length, 1), ALPHABET[0])
+
+
+def from_base62(code):
+    number = 0
+    for char in code:
+        number = number * len(ALPHABET) + ALPHABET.index(char)
+    return number
+
+
+def encode(recipe_id):
+    """Короткий код рецепта: перестановка id, записанная в base62.
+    По коду нельзя угадать соседние id, но он однозначно обратим."""
+    if recipe_id < 1 << SHORT_CODE_BITS:
+        return to_base62(feistel(
+            recipe_id, SHORT_CODE_BITS, range(FEISTEL_ROUNDS)
+        ))
+    return to_base62(
+        feistel(recipe_id, LONG_CODE_BITS, range(FEISTEL_ROUNDS)),
+        LONG_CODE_LENGTH,
+    )
+
+
+def decode(code):
+    """Id рецепта по короткому коду или None, если код некорректен."""
+    if not code or any(char not in ALPHABET for char in code):
+        return None
+    if len(code) == LONG_CODE_LENGTH:
+        bits = LONG_CODE_BITS
+    elif len(code) <= 6:
+        bits = SHORT_CODE_BITS
+    else:
+        return None
+    number = from_base62(code)
+    if number >= 1 << bits:
+        return None
+    # Обратная перестановка: те же раунды в обратном порядке
+    return feistel(number, bits, reversed(range(FEISTEL_ROUNDS)))
+
+
+def recipe_exists_key(recipe_id):
+    return f'recipe-exists:{recipe_id}'
+
+
+def recipe_exists(recipe_id):
+    """Есть ли рецепт с таким id. Ответ кэшируется, при создании
+    и удалении рецептов кэш обновляют сигналы."""
+    key = recipe_exists_key(recipe_id)
+    exists = cache.get(key)
+    if exists is None:
+        exists = Recipe.objects.filter(id=recipe_id).exists()
+        set_recipe_exists(recipe_id, exists)
+    return exists
+
+
+def set_recipe_exists(recipe_id, exists):
+    cache.set(
+        recipe_exists_key(recipe_id),
+        exists,
+        RECIPE_EXISTS_TIMEOUT if exists else RECIPE_MISSING_TIMEOUT,
+    )
+
+
+def resolve(short_code):
+    """Id существующего рецепта по короткой ссылке или None."""
+    recipe_id = decode(short_code)
+    if recipe_id is not None and recipe_exists(recipe_id):
+        return recipe_id
+    # Старые ссылки вида /s/<id>
+    if settings.SHORT_LINK_LEGACY_IDS and short_code.isdigit():
+        recipe_id = int(short_code)
+        if recipe_exists(recipe_id):
+            return recipe_id
+    return None
+
+
+class ClickCounter:
+    """Счётчик переходов по коротким ссылкам в памяти процесса.
+    Накопленные значения записываются в базу пачками."""
+
+    def __init__(self, batch_size=100, interval=30):
+        self.batch_size = batch_size
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.clicks = Counter()
+        self.pending = 0
+        self.flushed_at = time.monotonic()
+
+    def add(self, recipe_id):
+        with self.lock:
+            self.clicks[recipe_id] += 1
+            self.pending += 1
+            if (
+                self.pending < self.batch_size
+                and time.monotonic() - self.flushed_at < self.interval
+            ):
+                return
+        self.flush()
+
+    def flush(self):
+        with self.lock:
+            clicks, self.clicks = self.clicks, Counter()
+            self.pending = 0
+            self.flushed_at = time.monotonic()
+        if not clicks:
+            return
+        # Одним UPDATE для всей накопленной пачки
+        Recipe.objects.filter(id__in=clicks).update(
+            short_link_clicks=F('short_link_clicks') + Case(
+                *(
+                    When(id=recipe_id, then=Value(count))
+                    for recipe_id, count in clicks.items()
+                ),
+                output_field=PositiveIntegerField(),
+            )
+        )
+
+
+click_counter = ClickCounter()
+atexit.register(click_counter.flush)
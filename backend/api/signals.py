@@ -0,0 +1,134 @@
+import logging
+
+from django.contrib.auth import get_user_model
+from django.db.models.signals import (
+    post_delete, post_save, pre_delete, pre_save,
+)
+from django.dispatch import receiver
+from django.utils import timezone
+
+from recipes.models import Ingredient, IngredientRecipe, Recipe
+from users.models import Favorite, Follow, ShoppingCart
+
+from api.images import InvalidImage, generate_variants
+from api.ingredient_index import invalidate as invalidate_ingredient_index
+from api.pagination import invalidate_counts
+from api.recipe_index import record_change as record_recipe_index_change
+from api.serializers import invalidate_recipe_representations
+from api.short_links import set_recipe_exists
+
+User = get_user_model()
+
+logger = logging.getLogger(__name__)
+
+# Поля с файлами, которые освобождаются при замене или удалении объекта
+FILE_FIELDS = {Recipe: 'image', User: 'avatar'}
+
+
+@receiver((post_save, post_delete), sender=Ingredient)
+def ingredient_changed(instance, **kwargs):
+    invalidate_ingredient_index()
+
+
+# pre_delete: после каскадного удаления уже не узнать, в каких
+# рецептах был ингредиент
+@receiver((post_save, pre_delete), sender=Ingredient)
+def ingredient_recipes_changed(instance, **kwargs):
+    # Название и единица ингредиента входят в ответ рецепта,
+    # новый updated_at меняет его ETag и ключ кэша представления
+    recipe_ids = list(
+        IngredientRecipe.objects.filter(ingredient=instance)
+        .values_list('recipe_id', flat=True)
+    )
+    if not recipe_ids:
+        return
+    Recipe.objects.filter(id__in=recipe_ids).update(updated_at=timezone.now())
+    invalidate_recipe_representations(recipe_ids)
+
+
+@receiver((post_save, post_delete), sender=Recipe)
+def recipe_changed(instance, **kwargs):
+    invalidate_recipe_representations([instance.id])
+
+
+@receiver((post_save, post_delete), sender=IngredientRecipe)
+def recipe_ingredient_changed(instance, **kwargs):
+    invalidate_recipe_representations([instance.recipe_id])
+    record_recipe_index_change([instance.recipe_id])
+
+
+@receiver(post_save, sender=User)
+def author_changed(instance, update_fields=None, **kwargs):
+    # Вход в систему обновляет только last_login, он в ответ не попадает
+    if update_fields and set(update_fields) <= {'last_login'}:
+        return
+    invalidate_recipe_representations(
+        instance.recipes.values_list('id', flat=True)
+    )
+
+
+@receiver(post_save, sender=Recipe)
+def recipe_created(instance, created, **kwargs):
+    if created:
+        set_recipe_exists(instance.id, True)
+
+
+@receiver(post_delete, sender=Recipe)
+def recipe_deleted(instance, **kwargs):
+    set_recipe_exists(instance.id, False)
+
+
+@receiver(pre_save, sender=Recipe)
+@receiver(pre_save, sender=User)
+def remember_file_name(sender, instance, update_fields=None, **kwargs):
+    field = FILE_FIELDS[sender]
+    if instance.pk is None or (update_fields and field not in update_fields):
+        return
+    instance._previous_file = (
+        sender.objects.filter(pk=instance.pk)
+        .values_list(field, flat=True).first()
+    )
+
+
+@receiver(post_save, sender=Recipe)
+@receiver(post_save, sender=User)
+def file_saved(sender, instance, created, **kwargs):
+    # Без _previous_file у существующего объекта поле не сохранялось
+    if not created and '_previous_file' not in instance.__dict__:
+        return
+    previous = instance.__dict__.pop('_previous_file', None) or ''
+    file = getattr(instance, FILE_FIELDS[sender])
+    if previous == (file.name or ''):
+        return
+    try:
+        # Представление могли закэшировать со ссылками на оригинал,
+        # пока вариантов ещё не было
+        if generate_variants(file) and sender is Recipe:
+            invalidate_recipe_representations([instance.id])
+    except (InvalidImage, FileNotFoundError) as error:
+        # Без уменьшенных копий ответы отдают оригинал,
+        # сохранение объекта из-за них не должно падать
+        logger.warning(
+            'Не удалось создать копии %s для %s %s: %s',
+            file.name, sender._meta.label, instance.pk, error,
+        )
+    # Хранилище удалит файл, только если на него больше никто не ссылается
+    if previous:
+        file.storage.delete(previous)
+
+
+@receiver(post_delete, sender=Recipe)
+@receiver(post_delete, sender=User)
+def release_deleted_file(sender, instance, **kwargs):
+    file = getattr(instance, FILE_FIELDS[sender])
+    if file:
+        file.storage.delete(file.name)
+
+
+@receiver((post_save, post_delete), sender=Recipe)
+@receiver((post_save, post_delete), sender=Favorite)
+@receiver((post_save, post_delete), sender=ShoppingCart)
+@receiver((post_save, post_delete), sender=Follow)
+@receiver((post_save, post_delete), sender=User)
+def paginated_objects_changed(**kwargs):
+    invalidate_counts()
@@ -0,0 +1,376 @@
+import io
+import shutil
+import tempfile
+from unittest import mock
+
+from django.core.cache import cache, caches
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection, transaction
+from django.test import SimpleTestCase, TestCase, override_settings
+from PIL import Image
+from rest_framework.test import APITestCase
+
+from api.recipe_index import (
+    GENERATION_CACHE_KEY, RecipeIngredientIndex, change_cache_key,
+)
+from core.cache import InvalidationChannel, TieredCache
+from recipes.models import Ingredient, IngredientRecipe, Recipe
+from users.models import (
+    Favorite, Follow, ShoppingCart, ShoppingListItem, User,
+)
+
+TEMP_DIR = tempfile.mkdtemp()
+
+
+def tearDownModule():
+    shutil.rmtree(TEMP_DIR, ignore_errors=True)
+
+
+def make_image():
+    buffer = io.BytesIO()
+    Image.new('RGB', (10, 10), 'red').save(buffer, 'PNG')
+    return SimpleUploadedFile('recipe.png', buffer.getvalue(), 'image/png')
+
+
+# Кэш и файлы тестов не смешиваются с рабочими
+TEST_CACHES = {
+    'default': {
+        'BACKEND': 'core.cache.TieredCache',
+        'LOCATION': f'{TEMP_DIR}/cache/invalidations.log',
+        'OPTIONS': {'SHARED': 'shared'},
+    },
+    'shared': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+}
+
+
+@override_settings(MEDIA_ROOT=f'{TEMP_DIR}/media', CACHES=TEST_CACHES)
+class RecipeQueryCountTests(APITestCase):
+    """Число запросов не должно зависеть от числа рецептов на странице
+    и ингредиентов в рецепте."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            email='reader@example.com', username='reader',
+            first_name='Читатель', last_name='Тестовый', password='!',
+        )
+        authors = [
+            User.objects.create_user(
+                email=f'author{number}@example.com',
+                username=f'author{number}',
+                first_name='Автор', last_name=str(number), password='!',
+            )
+            for number in range(3)
+        ]
+        ingredients = Ingredient.objects.bulk_create(
+            Ingredient(name=f'ингредиент {number}', measurement_unit='г')
+            for number in range(10)
+        )
+        for number in range(6):
+            recipe = Recipe.objects.create(
+                author=authors[number % len(authors)],
+                name=f'Рецепт {number}',
+                image=make_image(),
+                text='Смешать и запечь.',
+                cooking_time=10,
+            )
+            IngredientRecipe.objects.bulk_create(
+                IngredientRecipe(
+                    recipe=recipe, ingredient=ingredient, amount=number + 1
+                )
+                for ingredient in ingredients[number:number + 4]
+            )
+            if number % 2:
+                Favorite.objects.create(user=cls.user, recipe=recipe)
+            else:
+                ShoppingCart.objects.create(user=cls.user, recipe=recipe)
+        cls.recipe = recipe
+        Follow.objects.create(user=cls.user, following=authors[0])
+
+    def setUp(self):
+        # Закэшированные представления и счётчики страниц скрыли бы запросы
+        cache.clear()
+        # В PostgreSQL пагинатор сначала смотрит оценку размера таблицы
+        self.list_queries = 3 + (connection.vendor == 'postgresql')
+
+    def test_list_anonymous(self):
+        with self.assertNumQueries(self.list_queries):
+            response = self.client.get('/api/recipes/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['results']), 6)
+
+    def test_list_authenticated(self):
+        self.client.force_authenticate(self.user)
+        with self.assertNumQueries(self.list_queries + 1):
+            response = self.client.get('/api/recipes/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['results']), 6)
+
+    def test_retrieve_anonymous(self):
+        with self.assertNumQueries(3):
+            response = self.client.get(f'/api/recipes/{self.recipe.id}/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['ingredients']), 4)
+
+    def test_retrieve_authenticated(self):
+        self.client.force_authenticate(self.user)
+        with self.assertNumQueries(4):
+            response = self.client.get(f'/api/recipes/{self.recipe.id}/')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.data['is_favorited'])
+
+
+@override_settings(MEDIA_ROOT=f'{TEMP_DIR}/media', CACHES=TEST_CACHES)
+class ImageVariantsTests(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user(
+            email='author@example.com', username='author',
+            first_name='Автор', last_name='Тестовый', password='!',
+        )
+
+    def setUp(self):
+        cache.clear()
+
+    def create_recipe(self, image):
+        return Recipe.objects.create(
+            author=self.author, name='Рецепт', image=image,
+            text='Смешать и запечь.', cooking_time=10,
+        )
+
+    def test_generated_variants(self):
+        recipe = self.create_recipe(make_image())
+        response = self.client.get(f'/api/recipes/{recipe.id}/')
+        self.assertTrue(
+            response.data['image_variants']['thumb']['webp']
+            .endswith('_thumb.webp')
+        )
+
+    def test_missing_variants_fall_back_to_original(self):
+        # Файла нет: варианты не создаются, но сохранение проходит
+        with self.assertLogs('api.signals', 'WARNING'):
+            recipe = self.create_recipe('recipes/missing.png')
+        response = self.client.get(f'/api/recipes/{recipe.id}/')
+        for urls in response.data['image_variants'].values():
+            for url in urls.values():
+                self.assertEqual(url, response.data['image'])
+
+
+@override_settings(MEDIA_ROOT=f'{TEMP_DIR}/media', CACHES=TEST_CACHES)
+class RecipeIngredientIndexTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        author = User.objects.create_user(
+            email='author@example.com', username='author',
+            first_name='Автор', last_name='Тестовый', password='!',
+        )
+        cls.a, cls.b, cls.c = (
+            Ingredient.objects.create(name=name, measurement_unit='г').id
+            for name in ('мука', 'сахар', 'соль')
+        )
+        cls.recipes = []
+        for ingredient_ids in ((cls.a, cls.b), (cls.a,), (cls.b, cls.c)):
+            recipe = Recipe.objects.create(
+                author=author, name='Рецепт', image=make_image(),
+                text='Смешать и запечь.', cooking_time=10,
+            )
+            IngredientRecipe.objects.bulk_create(
+                IngredientRecipe(
+                    recipe=recipe, ingredient_id=ingredient_id, amount=1
+                )
+                for ingredient_id in ingredient_ids
+            )
+            cls.recipes.append(recipe.id)
+
+    def setUp(self):
+        cache.clear()
+        cache.set(GENERATION_CACHE_KEY, 1, timeout=None)
+        self.index = RecipeIngredientIndex()
+
+    def test_lookups(self):
+        first, second, third = self.recipes
+        self.assertEqual(self.index.with_all({self.a, self.b}), {first})
+        self.assertEqual(self.index.with_any({self.c}), {third})
+        self.assertEqual(
+            self.index.with_only({self.a, self.b}), {first, second}
+        )
+        self.assertEqual(self.index.with_all({self.a, 0}), set())
+
+    def test_changes_are_applied_without_rebuild(self):
+        first, second, third = self.recipes
+        self.index.ensure_fresh()
+        with self.captureOnCommitCallbacks(execute=True):
+            IngredientRecipe.objects.filter(recipe_id=second).delete()
+            IngredientRecipe.objects.create(
+                recipe_id=second, ingredient_id=self.c, amount=1
+            )
+        # Одна транзакция — одно опубликованное изменение
+        self.assertEqual(cache.get(GENERATION_CACHE_KEY), 2)
+        with mock.patch.object(self.index, 'build') as build:
+            self.assertEqual(self.index.with_only({self.a, self.b}), {first})
+            self.assertEqual(
+                self.index.with_all({self.c}), {second, third}
+            )
+            self.assertEqual(self.index.with_any({self.a}), {first})
+        build.assert_not_called()
+
+    def test_change_registered_in_rolled_back_savepoint(self):
+        first, second, _ = self.recipes
+        with self.captureOnCommitCallbacks(execute=True):
+            try:
+                with transaction.atomic():
+                    IngredientRecipe.objects.filter(recipe_id=first).delete()
+                    raise RuntimeError
+            except RuntimeError:
+                pass
+            IngredientRecipe.objects.filter(recipe_id=second).delete()
+        self.assertEqual(cache.get(GENERATION_CACHE_KEY), 2)
+        self.assertEqual(cache.get(change_cache_key(2)), [second])
+
+
+@override_settings(MEDIA_ROOT=f'{TEMP_DIR}/media', CACHES=TEST_CACHES)
+class RelationEndpointTests(APITestCase):
+    """Избранное, корзина и подписки: ответы и счётчики."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            email='reader@example.com', username='reader',
+            first_name='Читатель', last_name='Тестовый', password='!',
+        )
+        cls.author = User.objects.create_user(
+            email='author@example.com', username='author',
+            first_name='Автор', last_name='Тестовый', password='!',
+        )
+        cls.ingredient = Ingredient.objects.create(
+            name='мука', measurement_unit='г'
+        )
+        cls.recipe = Recipe.objects.create(
+            author=cls.author, name='Рецепт', image=make_image(),
+            text='Смешать и запечь.', cooking_time=10,
+        )
+        IngredientRecipe.objects.create(
+            recipe=cls.recipe, ingredient=cls.ingredient, amount=200
+        )
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_authenticate(self.user)
+
+    def check_recipe_relation(self, url_name, counter):
+        url = f'/api/recipes/{self.recipe.id}/{url_name}/'
+        response = self.client.post(url)
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(
+            set(response.data), {'id', 'name', 'image', 'cooking_time'}
+        )
+        self.assertEqual(response.data['id'], self.recipe.id)
+        self.recipe.refresh_from_db()
+        self.assertEqual(getattr(self.recipe, counter), 1)
+
+        self.assertEqual(self.client.post(url).status_code, 400)
+        self.recipe.refresh_from_db()
+        self.assertEqual(getattr(self.recipe, counter), 1)
+
+        self.assertEqual(self.client.delete(url).status_code, 204)
+        self.recipe.refresh_from_db()
+        self.assertEqual(getattr(self.recipe, counter), 0)
+        self.assertEqual(self.client.delete(url).status_code, 400)
+
+        missing = f'/api/recipes/{self.recipe.id + 1000}/{url_name}/'
+        self.assertEqual(self.client.post(missing).status_code, 404)
+        self.assertEqual(self.client.delete(missing).status_code, 404)
+
+    def test_favorite(self):
+        self.check_recipe_relation('favorite', 'favorites_count')
+        self.assertFalse(Favorite.objects.exists())
+
+    def test_shopping_cart(self):
+        url = f'/api/recipes/{self.recipe.id}/shopping_cart/'
+        self.client.post(url)
+        self.assertEqual(
+            list(self.user.shopping_list.values_list('amount', flat=True)),
+            [200],
+        )
+        self.client.delete(url)
+        self.check_recipe_relation('shopping_cart', 'in_carts_count')
+        self.assertFalse(ShoppingCart.objects.exists())
+        self.assertFalse(ShoppingListItem.objects.exists())
+
+    def test_subscribe(self):
+        url = f'/api/users/{self.author.id}/subscribe/'
+        response = self.client.post(url)
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['id'], self.author.id)
+        self.assertTrue(response.data['is_subscribed'])
+        self.user.refresh_from_db()
+        self.author.refresh_from_db()
+        self.assertEqual(self.user.following_count, 1)
+        self.assertEqual(self.author.followers_count, 1)
+
+        self.assertEqual(self.client.post(url).status_code, 400)
+        self.assertEqual(
+            self.client.post(
+                f'/api/users/{self.user.id}/subscribe/'
+            ).status_code,
+            400,
+        )
+
+        self.assertEqual(self.client.delete(url).status_code, 204)
+        self.user.refresh_from_db()
+        self.author.refresh_from_db()
+        self.assertEqual(self.user.following_count, 0)
+        self.assertEqual(self.author.followers_count, 0)
+        self.assertEqual(self.client.delete(url).status_code, 400)
+        self.assertFalse(Follow.objects.exists())
+
+
+@override_settings(CACHES=TEST_CACHES)
+class TieredCacheTests(SimpleTestCase):
+    """Два экземпляра с общим журналом — как два процесса на машине."""
+
+    def setUp(self):
+        caches['shared'].clear()
+        self.log = f'{tempfile.mkdtemp(dir=TEMP_DIR)}/invalidations.log'
+        self.first, self.second = (
+            TieredCache(self.log, {'OPTIONS': {'SHARED': 'shared'}})
+            for _ in range(2)
+        )
+
+    def test_set_and_delete_evict_other_local_tier(self):
+        self.first.set('key', 1)
+        self.assertEqual(self.second.get('key'), 1)
+        self.assertEqual(self.second.get('key'), 1)
+        self.assertEqual(self.second.stats()['local_hits'], 1)
+
+        self.first.set('key', 2)
+        self.assertEqual(self.second.get('key'), 2)
+        self.first.delete('key')
+        self.assertIsNone(self.second.get('key'))
+
+    def test_reset_clears_all_local_tiers(self):
+        self.first.set('key', 1)
+        self.assertEqual(self.second.get('key'), 1)
+        # Запись в общий бэкенд в обход журнала локальный уровень не видит
+        caches['shared'].set('key', 2)
+        self.assertEqual(self.first.get('key'), 1)
+        self.assertEqual(self.second.get('key'), 1)
+
+        self.first.channel.reset()
+        self.assertEqual(self.first.get('key'), 2)
+        self.assertEqual(self.second.get('key'), 2)
+
+    def test_partial_line_is_read_on_next_call(self):
+        channel = InvalidationChannel(self.log, 1024 ** 2)
+        self.assertEqual(channel.receive(), [])
+        with open(self.log, 'ab') as file:
+            file.write(b'first\nsec')
+        self.assertEqual(channel.receive(), ['first'])
+        self.assertEqual(channel.receive(), [])
+        with open(self.log, 'ab') as file:
+            file.write(b'ond\n')
+        self.assertEqual(channel.receive(), ['second'])
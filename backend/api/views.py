@@ -1,9 +1,12 @@
 import os
-import tempfile
 
+from django.conf import settings
+from django.db import transaction
 from django.contrib.auth import get_user_model
-from django.db.models import Sum
-from django.http import FileResponse
+from django.db.models import Exists, F, OuterRef, Prefetch, Value, Window
+from django.db.models.functions import RowNumber
+from django.http import Http404, StreamingHttpResponse
+from django.utils.cache import patch_vary_headers
 from django.shortcuts import redirect
 from django_filters.rest_framework import DjangoFilterBackend
 from djoser.views import UserViewSet
@@ -13,12 +16,17 @@ from rest_framework.generics import get_object_or_404
 from rest_framework.permissions import AllowAny, IsAuthenticated, IsAuthenticatedOrReadOnly
 from rest_framework.response import Response
 from rest_framework import serializers
+from .conditional import conditional_response, make_etag
+from .exports import SHOPPING_CART_FORMATS
 from .filters import RecipeFilter
+from .ingredient_index import ingredient_index
+from .negotiation import IgnoreFormatContentNegotiation
 from .permissions import IsAuthorOrReadOnly
-from .serializers import UserSerializer, IngredientSerializer, UserAvatarSerializer, ShoppingCartSerializer, \
+from . import relations, short_links
+from .serializers import BulkIdsSerializer, UserSerializer, IngredientSerializer, UserAvatarSerializer, ShoppingCartSerializer, \
     FavoriteSerializer, CreateRecipeSerializer, RecipeSerializer, RecipeFromFavouritesSerializer, FollowSerializer
 from recipes.models import Ingredient, Recipe, IngredientRecipe
-from users.models import Follow, ShoppingCart, Favorite
+from users.models import Follow, ShoppingCart, ShoppingListItem, Favorite
 
 User = get_user_model()
 
@@ -78,7 +86,8 @@ class UserCustomViewSet(UserViewSet):
     def delete_avatar(self, request):
         user = request.user
         if user.avatar:
-            user.avatar.delete()
+            # Файл удаляется после сохранения (см. api.signals),
+            # пока на него ссылается пользователь, хранилище его не тронет
             user.avatar = None
             user.save()
 
@@ -100,34 +109,56 @@ class UserCustomViewSet(UserViewSet):
                     status=status.HTTP_400_BAD_REQUEST
                 )
 
-            if Follow.objects.filter(user=user, following=following).exists():
+            # Проверка и вставка — один INSERT с пропуском дубликата
+            if not relations.add(Follow, user.id, [following.id]):
                 return Response(
                     {"detail": "Вы уже подписаны на этого пользователя"},
                     status=status.HTTP_400_BAD_REQUEST
                 )
 
-            subscription = Follow.objects.create(user=user, following=following)
             serializer = FollowSerializer(
-                subscription,
+                Follow(user=user, following=following),
                 context={'request': request}
             )
             return Response(serializer.data, status=status.HTTP_201_CREATED)
 
         elif request.method == 'DELETE':
-            subscription = Follow.objects.filter(
-                user=user,
-                following=following
-            ).first()
-
-            if not subscription:
+            if not relations.remove(Follow, user.id, [following.id]):
                 return Response(
                     {"detail": "Подписка не найдена"},
                     status=status.HTTP_400_BAD_REQUEST
                 )
 
-            subscription.delete()
             return Response(status=status.HTTP_204_NO_CONTENT)
 
+    @action(
+        detail=False,
+        methods=('post', 'delete'),
+        permission_classes=(IsAuthenticated,),
+        url_path='bulk_subscribe',
+        url_name='bulk_subscribe',
+    )
+    def bulk_subscribe(self, request):
+        ids = get_bulk_ids(request)
+        with transaction.atomic():
+            found_ids = set(
+                User.objects.filter(id__in=ids).values_list('id', flat=True)
+            )
+            results = relations.apply_bulk(
+                Follow,
+                request.user.id,
+                ids,
+                found_ids,
+                adding=request.method == 'POST',
+                messages={
+                    'not_found': 'Пользователь не найден.',
+                    'self': 'Нельзя подписаться на себя',
+                    'exists': 'Вы уже подписаны на этого пользователя',
+                    'missing': 'Подписка не найдена',
+                },
+            )
+        return Response({'results': results})
+
     @action(
         detail=False,
         methods=['get'],
@@ -135,8 +166,7 @@ class UserCustomViewSet(UserViewSet):
         url_path='subscriptions'
     )
     def subscriptions(self, request):
-        user = request.user
-        queryset = Follow.objects.filter(user=user).select_related('following')
+        queryset = self.get_subscriptions_queryset(request)
         page = self.paginate_queryset(queryset)
 
         if page is not None:
@@ -154,6 +184,32 @@ class UserCustomViewSet(UserViewSet):
         )
         return Response(serializer.data)
 
+    def get_subscriptions_queryset(self, request):
+        return (
+            Follow.objects.filter(user=request.user)
+            .select_related('following')
+            .prefetch_related(Prefetch(
+                'following__recipes',
+                queryset=self.get_limited_recipes(request),
+                to_attr='limited_recipes',
+            ))
+            .order_by('id')
+        )
+
+    def get_limited_recipes(self, request):
+        # Первые recipes_limit рецептов каждого автора одним запросом
+        recipes = Recipe.objects.all()
+        limit = request.query_params.get('recipes_limit')
+        if limit and limit.isdigit():
+            recipes = recipes.annotate(
+                row_number=Window(
+                    RowNumber(),
+                    partition_by=F('author_id'),
+                    order_by=F('id').asc(),
+                )
+            ).filter(row_number__lte=int(limit))
+        return recipes
+
 
 class IngredientViewSet(viewsets.ReadOnlyModelViewSet):
     queryset = Ingredient.objects.all()
@@ -162,12 +218,49 @@ class IngredientViewSet(viewsets.ReadOnlyModelViewSet):
     search_fields = ("^name",)
     pagination_class = None
 
-    def get_queryset(self):
-        queryset = super().get_queryset()
-        name = self.request.query_params.get('name', None)
-        if name:
-            queryset = queryset.filter(name__istartswith=name)
-        return queryset
+    def list(self, request, *args, **kwargs):
+        # Автодополнение обслуживается индексом в памяти, без запросов к БД
+        name = request.query_params.get('name', None)
+
+        def get_response():
+            if name:
+                ingredients = ingredient_index.search(name)
+            else:
+                ingredients = ingredient_index.all()
+            serializer = self.get_serializer(ingredients, many=True)
+            return Response(serializer.data)
+
+        return conditional_response(
+            request,
+            get_response,
+            etag=make_etag(
+                ingredient_index.fingerprint(),
+                name,
+                request.accepted_media_type,
+            ),
+        )
+
+    def retrieve(self, request, *args, **kwargs):
+        updated_at = None
+        # Нечисловой pk обработает стандартный retrieve и ответит 404
+        if str(kwargs['pk']).isdigit():
+            updated_at = (
+                Ingredient.objects.filter(pk=kwargs['pk'])
+                .values_list('updated_at', flat=True)
+                .first()
+            )
+        if updated_at is None:
+            return super().retrieve(request, *args, **kwargs)
+        return conditional_response(
+            request,
+            lambda: super(IngredientViewSet, self).retrieve(
+                request, *args, **kwargs
+            ),
+            etag=make_etag(
+                kwargs['pk'], updated_at, request.accepted_media_type
+            ),
+            last_modified=updated_at,
+        )
 
 
 class RecipeViewSet(viewsets.ModelViewSet):
@@ -175,6 +268,8 @@ class RecipeViewSet(viewsets.ModelViewSet):
     permission_classes = (IsAuthenticatedOrReadOnly, IsAuthorOrReadOnly)
     filter_backends = (DjangoFilterBackend,)
     filterset_class = RecipeFilter
+    # Действия, которые отдают рецепт целиком через RecipeSerializer
+    serialized_actions = ("list", "retrieve", "partial_update")
 
     def get_serializer_class(self):
         if self.action in ("create", "partial_update"):
@@ -183,18 +278,93 @@ class RecipeViewSet(viewsets.ModelViewSet):
         return RecipeSerializer
 
     def get_queryset(self):
-        queryset = super().get_queryset()
-        is_favorited = self.request.query_params.get('is_favorited')
+        queryset = self.plan_queryset(super().get_queryset())
+        queryset = self.annotate_user_flags(queryset)
+        if not self.request.user.is_authenticated:
+            return queryset
 
-        if is_favorited in ("1", 1, True) and self.request.user.is_authenticated:
-            queryset = queryset.filter(favorites__user=self.request.user)
+        is_favorited = self.request.query_params.get('is_favorited')
+        if is_favorited in ("1", 1, True):
+            queryset = queryset.filter(is_favorited=True)
 
         is_in_shopping_cart = self.request.query_params.get('is_in_shopping_cart')
-        if is_in_shopping_cart in ("1", 1, True) and self.request.user.is_authenticated:
-            queryset = queryset.filter(shopping_carts__user=self.request.user)
+        if is_in_shopping_cart in ("1", 1, True):
+            queryset = queryset.filter(is_in_shopping_cart=True)
 
         return queryset
 
+    def retrieve(self, request, *args, **kwargs):
+        validators = self.get_recipe_validators(kwargs['pk'])
+        if validators is None:
+            return super().retrieve(request, *args, **kwargs)
+        # Флаги пользователя не меняют updated_at рецепта,
+        # поэтому Last-Modified отдаём только анонимам
+        last_modified = None
+        if not request.user.is_authenticated:
+            last_modified = validators['updated_at']
+        response = conditional_response(
+            request,
+            lambda: super(RecipeViewSet, self).retrieve(
+                request, *args, **kwargs
+            ),
+            etag=make_etag(
+                validators,
+                request.build_absolute_uri('/'),
+                request.accepted_media_type,
+            ),
+            last_modified=last_modified,
+        )
+        patch_vary_headers(response, ('Authorization',))
+        return response
+
+    def get_recipe_validators(self, pk):
+        # Всё, от чего зависит ответ retrieve, одним запросом
+        # и без сериализации рецепта
+        if not str(pk).isdigit():
+            return None
+        queryset = self.annotate_user_flags(Recipe.objects.filter(pk=pk))
+        user = self.request.user
+        if user.is_authenticated:
+            queryset = queryset.annotate(author_is_subscribed=Exists(
+                Follow.objects.filter(user=user, following=OuterRef('author'))
+            ))
+        else:
+            queryset = queryset.annotate(author_is_subscribed=Value(False))
+        return queryset.values(
+            'id', 'updated_at', 'is_favorited', 'is_in_shopping_cart',
+            'author_is_subscribed', 'author_id', 'author__email',
+            'author__username', 'author__first_name', 'author__last_name',
+            'author__avatar',
+        ).first()
+
+    def plan_queryset(self, queryset):
+        if self.action not in self.serialized_actions:
+            return queryset
+        return queryset.select_related("author").prefetch_related(
+            Prefetch(
+                "recipe_ingredients",
+                queryset=IngredientRecipe.objects.select_related("ingredient"),
+            )
+        )
+
+    def annotate_user_flags(self, queryset):
+        # Флаги избранного и корзины считаются в основном запросе,
+        # а не отдельным запросом на каждый рецепт страницы
+        user = self.request.user
+        if not user.is_authenticated:
+            return queryset.annotate(
+                is_favorited=Value(False),
+                is_in_shopping_cart=Value(False),
+            )
+        return queryset.annotate(
+            is_favorited=Exists(
+                Favorite.objects.filter(user=user, recipe=OuterRef('pk'))
+            ),
+            is_in_shopping_cart=Exists(
+                ShoppingCart.objects.filter(user=user, recipe=OuterRef('pk'))
+            ),
+        )
+
     def get_serializer_context(self):
         context = super().get_serializer_context()
         context.update({"request": self.request})
@@ -215,27 +385,34 @@ class RecipeViewSet(viewsets.ModelViewSet):
         return self.delete_user_recipe_relation(
             request,
             pk,
-            "favorites",
-            Favorite.DoesNotExist,
+            Favorite,
             "Рецепт не в избранном.",
         )
 
     def add_recipe_to_favorite(self, request, pk):
-        try:
-            recipe = Recipe.objects.get(pk=pk)
-        except Recipe.DoesNotExist:
+        return self.add_user_recipe_relation(
+            request, pk, Favorite, "Рецепт уже в избранном."
+        )
+
+    def add_user_recipe_relation(self, request, pk, model, exists_message):
+        # Поиск рецепта, проверка дубликата и вставка выполняются
+        # одним запросом и опираются на уникальное ограничение
+        recipe, created = None, False
+        if str(pk).isdigit():
+            recipe, created = relations.add_recipe(
+                model, request.user.id, int(pk)
+            )
+        if recipe is None:
             return Response(
                 {"detail": "Рецепт не найден."},
                 status=status.HTTP_404_NOT_FOUND
             )
-        if request.user.favorites.filter(recipe_id=pk).exists():
+        if not created:
             return Response(
-                {"errors": "Рецепт уже в избранном."},
+                {"errors": exists_message},
                 status=status.HTTP_400_BAD_REQUEST
             )
 
-        Favorite.objects.create(user=request.user, recipe=recipe)
-
         serializer = RecipeFromFavouritesSerializer(
             recipe,
             context={'request': request}
@@ -246,20 +423,20 @@ class RecipeViewSet(viewsets.ModelViewSet):
             self,
             request,
             pk,
-            related_name_for_user,
-            does_not_exist_exception,
+            model,
             does_not_exist_message,
     ):
-        if not Recipe.objects.filter(id=pk).exists():  # Если рецепта нет в БД
+        found, removed = False, False
+        if str(pk).isdigit():
+            found, removed = relations.remove_recipe(
+                model, request.user.id, int(pk)
+            )
+        if not found:  # Если рецепта нет в БД
             return Response(
                 {"error": "Рецепт не найден"},
                 status=status.HTTP_404_NOT_FOUND,
             )
-        try:
-            getattr(request.user, related_name_for_user).get(
-                user=request.user, recipe_id=pk
-            ).delete()
-        except does_not_exist_exception:
+        if not removed:
             return Response(
                 does_not_exist_message,
                 status=status.HTTP_400_BAD_REQUEST,
@@ -282,83 +459,135 @@ class RecipeViewSet(viewsets.ModelViewSet):
         return self.delete_user_recipe_relation(
             request,
             pk,
-            "shopping_carts",
-            ShoppingCart.DoesNotExist,
+            ShoppingCart,
             "Рецепт не в корзине",
         )
 
     def add_recipe_to_cart(self, request, pk):
-        try:
-            recipe = Recipe.objects.get(pk=pk)
-        except Recipe.DoesNotExist:
-            return Response(
-                {"detail": "Рецепт не найден."},
-                status=status.HTTP_404_NOT_FOUND
-            )
-        if request.user.shopping_carts.filter(recipe_id=pk).exists():
-            return Response(
-                {"errors": "Рецепт уже в корзине."},
-                status=status.HTTP_400_BAD_REQUEST
-            )
+        return self.add_user_recipe_relation(
+            request, pk, ShoppingCart, "Рецепт уже в корзине."
+        )
 
-        ShoppingCart.objects.create(user=request.user, recipe=recipe)
+    @action(
+        detail=False,
+        methods=("post", "delete"),
+        permission_classes=(IsAuthenticated,),
+        url_path="bulk_favorite",
+        url_name="bulk_favorite",
+    )
+    def bulk_favorite(self, request):
+        return self.bulk_user_recipe_relation(
+            request,
+            Favorite,
+            "Рецепт уже в избранном.",
+            "Рецепт не в избранном.",
+        )
 
-        serializer = RecipeFromFavouritesSerializer(
-            recipe,
-            context={'request': request}
+    @action(
+        detail=False,
+        methods=("post", "delete"),
+        permission_classes=(IsAuthenticated,),
+        url_path="bulk_shopping_cart",
+        url_name="bulk_shopping_cart",
+    )
+    def bulk_shopping_cart(self, request):
+        return self.bulk_user_recipe_relation(
+            request,
+            ShoppingCart,
+            "Рецепт уже в корзине.",
+            "Рецепт не в корзине",
         )
-        return Response(serializer.data, status=status.HTTP_201_CREATED)
+
+    def bulk_user_recipe_relation(
+            self, request, model, exists_message, missing_message
+    ):
+        # Все рецепты списка обрабатываются в одной транзакции,
+        # для каждого возвращается результат отдельно
+        ids = get_bulk_ids(request)
+        with transaction.atomic():
+            found_ids = set(
+                Recipe.objects.filter(id__in=ids).values_list('id', flat=True)
+            )
+            results = relations.apply_bulk(
+                model,
+                request.user.id,
+                ids,
+                found_ids,
+                adding=request.method == "POST",
+                messages={
+                    'not_found': 'Рецепт не найден.',
+                    'exists': exists_message,
+                    'missing': missing_message,
+                },
+            )
+        return Response({"results": results})
 
     @action(methods=['get'], detail=True, url_path='get-link')
     def get_link(self, request, pk):
-        get_object_or_404(Recipe, id=pk)
-        short_link = f"{os.getenv('HOSTNAME', 'localhost')}/s/{pk}"
+        recipe = get_object_or_404(Recipe, id=pk)
+        short_code = short_links.encode(recipe.id)
+        short_link = f"{os.getenv('HOSTNAME', 'localhost')}/s/{short_code}"
         return Response({'short-link': short_link}, status=status.HTTP_200_OK)
 
     @action(
         detail=False,
         methods=['get'],
         permission_classes=[IsAuthenticated],
-        url_path='download_shopping_cart'
+        url_path='download_shopping_cart',
+        content_negotiation_class=IgnoreFormatContentNegotiation,
     )
     def download_cart(self, request):
+        file_format = request.query_params.get('format', 'txt')
+        if file_format not in SHOPPING_CART_FORMATS:
+            return Response(
+                {"format": [
+                    f"Поддерживаемые форматы: "
+                    f"{', '.join(SHOPPING_CART_FORMATS)}"
+                ]},
+                status=status.HTTP_400_BAD_REQUEST
+            )
         ingredient_data = self.get_ingredients(request.user)
-        return self.make_file(ingredient_data)
+        return self.make_file(ingredient_data, file_format)
 
     def get_ingredients(self, user):
+        # Сводный список поддерживается при изменении корзины,
+        # поэтому выгрузка — простое чтение без агрегации
         return (
-            IngredientRecipe.objects
-            .filter(recipe__shopping_carts__user=user)
-            .values('ingredient__name', 'ingredient__measurement_unit')
-            .annotate(quantity=Sum('amount'))
+            ShoppingListItem.objects
+            .filter(user=user)
+            .values(
+                'ingredient__name',
+                'ingredient__measurement_unit',
+                quantity=F('amount'),
+            )
             .order_by('ingredient__name')
         )
 
-    def make_file(self, ingredient_records):
-        file_lines = [
-            f"{item['ingredient__name']} ({item['ingredient__measurement_unit']}) - {item['quantity']}"
-            for item in ingredient_records
-        ]
-
-        with tempfile.NamedTemporaryFile(
-                mode='w+',
-                suffix='.txt',
-                encoding='UTF-8',
-                delete=False
-        ) as tmp:
-            tmp.write('\n'.join(file_lines))
-            tmp.flush()
-
-            response = FileResponse(
-                open(tmp.name, 'rb'),
-                as_attachment=True,
-                filename='cart.txt',
-                content_type='text/plain'
-            )
+    def make_file(self, ingredient_records, file_format):
+        # Строки файла отдаются по мере чтения из курсора,
+        # без сборки списка целиком и без временных файлов
+        render, content_type = SHOPPING_CART_FORMATS[file_format]
+        response = StreamingHttpResponse(
+            render(ingredient_records.iterator()),
+            content_type=content_type
+        )
+        response['Content-Disposition'] = (
+            f'attachment; filename="cart.{file_format}"'
+        )
+        return response
+
 
-            return response
+def get_bulk_ids(request):
+    serializer = BulkIdsSerializer(data=request.data)
+    serializer.is_valid(raise_exception=True)
+    return serializer.validated_data['ids']
 
 
 def short_link_redirect(request, short_code):
-    recipe = get_object_or_404(Recipe, id=short_code)
-    return redirect(f'/recipes/{recipe.id}/')
+    # Существование рецепта проверяется по кэшу, без запроса к базе
+    recipe_id = short_links.resolve(short_code)
+    if recipe_id is None:
+        raise Http404
+    if settings.SHORT_LINK_CLICKS:
+        short_links.click_counter.add(recipe_id)
+    return redirect(f'/recipes/{recipe_id}/')
@@ -0,0 +1,286 @@
+import os
+import pickle
+import random
+import threading
+import time
+from collections import OrderedDict
+
+from django.core.cache import caches
+from django.core.cache.backends import filebased
+from django.core.cache.backends.base import DEFAULT_TIMEOUT, BaseCache
+
+MISSING = object()
+
+
+class InvalidationChannel:
+    """Журнал инвалидаций в файле, общий для всех процессов на машине.
+
+    Запись ключа дописывается в конец файла, каждый процесс читает журнал
+    со своей позиции. Когда журнал разрастается, его заменяют пустым
+    файлом: процессы видят новый inode и сбрасывают свой кэш целиком."""
+
+    def __init__(self, path, max_size):
+        self.path = path
+        self.max_size = max_size
+        self.inode = None
+        self.offset = 0
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    def publish(self, keys):
+        data = ''.join(f'{key}\n' for key in keys).encode()
+        with open(self.path, 'ab') as file:
+            file.write(data)
+            end = file.tell()
+            inode = os.fstat(file.fileno()).st_ino
+        # Свою же запись читать не нужно, если до неё журнал уже прочитан
+        if inode == self.inode and end - len(data) == self.offset:
+            self.offset = end
+        if end > self.max_size:
+            self.reset()
+
+    def reset(self):
+        # Пустой файл журнала с новым inode сбрасывает кэш всех процессов
+        temporary = f'{self.path}.{os.getpid()}'
+        open(temporary, 'wb').close()
+        os.replace(temporary, self.path)
+
+    def receive(self):
+        """Ключи, инвалидированные с прошлого вызова; None, если нужно
+        сбросить кэш целиком."""
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            open(self.path, 'ab').close()
+            stat = os.stat(self.path)
+        if stat.st_ino != self.inode or stat.st_size < self.offset:
+            first_call = self.inode is None
+            self.inode, self.offset = stat.st_ino, stat.st_size
+            return [] if first_call else None
+        if stat.st_size == self.offset:
+            return []
+        with open(self.path, 'rb') as file:
+            file.seek(self.offset)
+            data = file.read(stat.st_size - self.offset)
+        # Недописанную последнюю строку дочитаем в следующий раз
+        complete = data.rfind(b'\n') + 1
+        self.offset += complete
+        return data[:complete].decode().split()
+
+
+class FileBasedCache(filebased.FileBasedCache):
+    """Файловый кэш, который при переполнении не удаляет бессрочные записи.
+
+    В них (timeout=None) хранятся версии и поколения, по которым процессы
+    согласуют свои кэши и индексы; случайное удаление такого ключа
+    сбрасывает или, хуже, откатывает поколение. Удаляются только записи
+    со сроком жизни, в прочем поведение как у FileBasedCache."""
+
+    def _cull(self):
+        filelist = self._list_cache_files()
+        num_entries = len(filelist)
+        if num_entries < self._max_entries:
+            return
+        if self._cull_frequency == 0:
+            to_delete = num_entries
+        else:
+            to_delete = int(num_entries / self._cull_frequency)
+        random.shuffle(filelist)
+        for fname in filelist:
+            if to_delete <= 0:
+                break
+            if self._is_permanent(fname):
+                continue
+            self._delete(fname)
+            to_delete -= 1
+
+    def _is_permanent(self, fname):
+        # Файл начинается с pickle срока жизни, None — бессрочная запись
+        try:
+            with open(fname, 'rb') as file:
+                return pickle.load(file) is None
+        except (OSError, EOFError, pickle.UnpicklingError):
+            return False
+
+
+class TieredCache(BaseCache):
+    """Двухуровневый кэш: LRU в памяти процесса перед общим бэкендом
+    (алиас OPTIONS['SHARED'] в CACHES, например файловый или Redis).
+
+    Записи локального уровня ограничены по суммарному размеру и времени
+    жизни; изменения ключей в любом процессе доходят до остальных через
+    InvalidationChannel (LOCATION — путь к файлу журнала)."""
+
+    def __init__(self, location, params):
+        super().__init__(params)
+        options = params.get('OPTIONS', {})
+        self.shared_alias = options.get('SHARED', 'shared')
+        self.local_max_bytes = options.get('LOCAL_MAX_BYTES', 32 * 1024 ** 2)
+        self.local_timeout = options.get('LOCAL_TIMEOUT', 60)
+        self.channel = InvalidationChannel(
+            location, options.get('CHANNEL_MAX_SIZE', 1024 ** 2)
+        )
+        self.local = OrderedDict()
+        self.local_bytes = 0
+        self.lock = threading.Lock()
+        self.counters = dict.fromkeys(
+            ('local_hits', 'shared_hits', 'misses', 'sets', 'invalidations'),
+            0,
+        )
+
+    @property
+    def shared(self):
+        return caches[self.shared_alias]
+
+    def stats(self):
+        """Статистика попаданий текущего процесса."""
+        counters = dict(self.counters)
+        lookups = (
+            counters['local_hits'] + counters['shared_hits']
+            + counters['misses']
+        )
+        counters['local_entries'] = len(self.local)
+        counters['local_bytes'] = self.local_bytes
+        counters['local_hit_rate'] = (
+            counters['local_hits'] / lookups if lookups else 0.0
+        )
+        counters['hit_rate'] = (
+            (counters['local_hits'] + counters['shared_hits']) / lookups
+            if lookups else 0.0
+        )
+        return counters
+
+    def sync(self):
+        keys = self.channel.receive()
+        if keys is None:
+            self.local_clear()
+            return
+        for key in keys:
+            self.local_delete(key)
+
+    def local_get(self, key):
+        with self.lock:
+            entry = self.local.get(key)
+            if entry is None:
+                return MISSING
+            expires_at, pickled = entry
+            if expires_at <= time.monotonic():
+                self._local_pop(key)
+                return MISSING
+            self.local.move_to_end(key)
+        return pickle.loads(pickled)
+
+    def local_set(self, key, value, timeout):
+        if timeout is not None and timeout <= 0:
+            self.local_delete(key)
+            return
+        local_timeout = self.local_timeout
+        if timeout is not None:
+            local_timeout = min(local_timeout, timeout)
+        pickled = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        if len(pickled) > self.local_max_bytes:
+            self.local_delete(key)
+            return
+        with self.lock:
+            self._local_pop(key)
+            self.local[key] = (time.monotonic() + local_timeout, pickled)
+            self.local_bytes += len(pickled)
+            while self.local_bytes > self.local_max_bytes:
+                self._local_pop(next(iter(self.local)))
+
+    def local_delete(self, key):
+        with self.lock:
+            self._local_pop(key)
+
+    def local_clear(self):
+        with self.lock:
+            self.local.clear()
+            self.local_bytes = 0
+
+    def _local_pop(self, key):
+        entry = self.local.pop(key, None)
+        if entry is not None:
+            self.local_bytes -= len(entry[1])
+
+    def invalidate(self, keys):
+        self.counters['invalidations'] += len(keys)
+        for key in keys:
+            self.local_delete(key)
+        self.channel.publish(keys)
+
+    def resolve_timeout(self, timeout=DEFAULT_TIMEOUT):
+        if timeout == DEFAULT_TIMEOUT:
+            timeout = self.default_timeout
+        return timeout
+
+    def get(self, key, default=None, version=None):
+        local_key = self.make_and_validate_key(key, version=version)
+        self.sync()
+        value = self.local_get(local_key)
+        if value is not MISSING:
+            self.counters['local_hits'] += 1
+            return value
+        value = self.shared.get(key, MISSING, version=version)
+        if value is MISSING:
+            self.counters['misses'] += 1
+            return default
+        self.counters['shared_hits'] += 1
+        self.local_set(local_key, value, None)
+        return value
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        local_key = self.make_and_validate_key(key, version=version)
+        timeout = self.resolve_timeout(timeout)
+        self.counters['sets'] += 1
+        self.shared.set(key, value, timeout, version=version)
+        self.invalidate([local_key])
+        self.local_set(local_key, value, timeout)
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        local_key = self.make_and_validate_key(key, version=version)
+        timeout = self.resolve_timeout(timeout)
+        added = self.shared.add(key, value, timeout, version=version)
+        if added:
+            self.counters['sets'] += 1
+            self.invalidate([local_key])
+            self.local_set(local_key, value, timeout)
+        return added
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        local_key = self.make_and_validate_key(key, version=version)
+        timeout = self.resolve_timeout(timeout)
+        touched = self.shared.touch(key, timeout, version=version)
+        self.invalidate([local_key])
+        return touched
+
+    def delete(self, key, version=None):
+        local_key = self.make_and_validate_key(key, version=version)
+        deleted = self.shared.delete(key, version=version)
+        self.invalidate([local_key])
+        return deleted
+
+    def delete_many(self, keys, version=None):
+        keys = list(keys)
+        if not keys:
+            return
+        local_keys = [
+            self.make_and_validate_key(key, version=version) for key in keys
+        ]
+        self.shared.delete_many(keys, version=version)
+        self.invalidate(local_keys)
+
+    def incr(self, key, delta=1, version=None):
+        local_key = self.make_and_validate_key(key, version=version)
+        value = self.shared.incr(key, delta, version=version)
+        self.invalidate([local_key])
+        return value
+
+    def has_key(self, key, version=None):
+        return self.get(key, MISSING, version=version) is not MISSING
+
+    def clear(self):
+        self.shared.clear()
+        self.local_clear()
+        self.channel.reset()
+
+    def close(self, **kwargs):
+        self.shared.close(**kwargs)
@@ -1,4 +1,5 @@
 import os
+import tempfile
 from pathlib import Path
 
 from django.core.management.utils import get_random_secret_key
@@ -23,6 +24,8 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    # OpClass в индексах моделей
+    'django.contrib.postgres',
 
     'rest_framework',
     'rest_framework.authtoken',
@@ -78,6 +81,56 @@ DATABASES = {
     }
 }
 
+# Cache
+# Локальный LRU в каждом процессе перед общим кэшем, см. core.cache
+
+CACHE_DIR = os.getenv(
+    'CACHE_DIR', os.path.join(tempfile.gettempdir(), 'foodgram-cache')
+)
+
+SHARED_CACHE_BACKEND = os.getenv(
+    'SHARED_CACHE_BACKEND', 'core.cache.FileBasedCache'
+)
+
+CACHES = {
+    'default': {
+        'BACKEND': 'core.cache.TieredCache',
+        'LOCATION': os.path.join(CACHE_DIR, 'invalidations.log'),
+        'OPTIONS': {
+            'SHARED': 'shared',
+            'LOCAL_MAX_BYTES': int(os.getenv('CACHE_LOCAL_MAX_BYTES', 32 * 1024 ** 2)),
+            'LOCAL_TIMEOUT': int(os.getenv('CACHE_LOCAL_TIMEOUT', 60)),
+        },
+    },
+    'shared': {
+        'BACKEND': SHARED_CACHE_BACKEND,
+        'LOCATION': os.getenv(
+            'SHARED_CACHE_LOCATION', os.path.join(CACHE_DIR, 'shared')
+        ),
+    },
+}
+# По умолчанию Django держит 300 записей, а в кэше лежит представление
+# каждого рецепта. Параметр понимают файловый, LocMem и DB-кэши;
+# Redis и Memcached ограничивают память своими настройками
+if SHARED_CACHE_BACKEND.endswith(
+    ('FileBasedCache', 'LocMemCache', 'DatabaseCache')
+):
+    CACHES['shared']['OPTIONS'] = {
+        'MAX_ENTRIES': int(os.getenv('SHARED_CACHE_MAX_ENTRIES', 20000)),
+    }
+
+# Короткие ссылки на рецепты
+# Ключ перестановки id; при смене ключа все выданные ссылки меняются
+SHORT_LINK_KEY = os.getenv('SHORT_LINK_KEY', 'foodgram-short-links')
+# Открывать ли старые ссылки вида /s/<id>
+SHORT_LINK_LEGACY_IDS = os.getenv(
+    'SHORT_LINK_LEGACY_IDS', default='True'
+).lower() in ('true', '1')
+# Считать переходы по коротким ссылкам
+SHORT_LINK_CLICKS = os.getenv(
+    'SHORT_LINK_CLICKS', default='False'
+).lower() in ('true', '1')
+
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
 
@@ -141,6 +194,24 @@ DJOSER = {
 
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
+# Загрузки крупнее этого размера пишутся во временный файл на диске
+FILE_UPLOAD_MAX_MEMORY_SIZE = 512 * 1024
+
+STORAGES = {
+    'default': {
+        'BACKEND': 'core.storage.ContentAddressedStorage',
+        'OPTIONS': {
+            # Поля, ссылки из которых не дают удалить файл
+            'references': ('recipes.Recipe.image', 'users.User.avatar'),
+            # Более молодые файлы удаляет только gc_media
+            'min_age': 3600,
+        },
+    },
+    'staticfiles': {
+        'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage',
+    },
+}
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.1/ref/settings/#default-auto-field
 
@@ -0,0 +1,98 @@
+import hashlib
+import os
+import posixpath
+import re
+import time
+
+from django.apps import apps
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage
+from django.db import transaction
+
+# <каталог>/<2 символа хеша>/<sha256>[_<вариант>].<расширение>
+CONTENT_ADDRESSED_NAME = re.compile(
+    r'(?:^|/)(?P<prefix>[0-9a-f]{2})/(?P=prefix)[0-9a-f]{62}'
+    r'(?:_\w+)?\.\w+$'
+)
+
+
+def content_hash(content):
+    digest = hashlib.sha256()
+    for chunk in content.chunks():
+        digest.update(chunk)
+    content.seek(0)
+    return digest.hexdigest()
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    """Файловое хранилище, где имя файла — хеш его содержимого.
+
+    Одинаковые файлы хранятся один раз: повторная загрузка не пишет
+    на диск, а возвращает имя существующего файла. Файл удаляется,
+    только когда на него не ссылается ни одно поле из references
+    (строки вида 'app_label.Model.field') и он не моложе min_age секунд."""
+
+    def __init__(self, references=(), min_age=3600, **kwargs):
+        super().__init__(**kwargs)
+        self.references = tuple(references)
+        self.min_age = min_age
+
+    def hashed_name(self, name, content):
+        directory, basename = posixpath.split(name)
+        ext = os.path.splitext(basename)[1].lower()
+        digest = content_hash(content)
+        return posixpath.join(directory, digest[:2], f'{digest}{ext}')
+
+    def save(self, name, content, max_length=None):
+        if name is None:
+            name = content.name
+        if not hasattr(content, 'chunks'):
+            content = File(content, name)
+        # Производные файлы (варианты изображений) уже названы по хешу
+        # исходного файла и сохраняются под своим именем
+        if not CONTENT_ADDRESSED_NAME.search(name):
+            name = self.hashed_name(name, content)
+        try:
+            # Файл уже есть: свежее время изменения защищает его от удаления,
+            # пока объект с ним не сохранён (см. delete_unreferenced)
+            os.utime(self.path(name))
+            return name
+        except FileNotFoundError:
+            pass
+        saved = super().save(name, content, max_length)
+        if saved != name:
+            # Тот же файл одновременно записал другой запрос
+            super().delete(saved)
+        return name
+
+    def is_referenced(self, name):
+        for reference in self.references:
+            app_label, model_name, field = reference.split('.')
+            model = apps.get_model(app_label, model_name)
+            if model._default_manager.filter(**{field: name}).exists():
+                return True
+        return False
+
+    def delete(self, name):
+        """Удаляет файл и его варианты после завершения транзакции,
+        если на него больше никто не ссылается."""
+        transaction.on_commit(lambda: self.delete_unreferenced(name))
+
+    def delete_unreferenced(self, name):
+        if not name or self.is_referenced(name):
+            return
+        # Тот же файл мог только что загрузить другой запрос, ссылка на него
+        # появится после фиксации его транзакции. Такие файлы остаются
+        # команде gc_media
+        try:
+            if os.path.getmtime(self.path(name)) > time.time() - self.min_age:
+                return
+        except FileNotFoundError:
+            pass
+        stem, _ = os.path.splitext(name)
+        directory, basename = posixpath.split(stem)
+        if self.exists(directory):
+            for filename in self.listdir(directory)[1]:
+                if filename.startswith(f'{basename}_'):
+                    super().delete(posixpath.join(directory, filename))
+        super().delete(name)
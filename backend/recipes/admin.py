@@ -1,4 +1,6 @@
 from django.contrib import admin
+from users import counters, shopping_list
+
 from .models import Ingredient, Recipe, IngredientRecipe
 
 
@@ -25,10 +27,18 @@ class RecipeAdmin(admin.ModelAdmin):
     inlines = (IngredientRecipeInline,)
     readonly_fields = ('favorites_count',)
 
-    def favorites_count(self, obj):
-        return obj.favorites.count()
-
-    favorites_count.short_description = 'В избранном у'
+    def save_model(self, request, obj, form, change):
+        # Автора меняют только здесь, счётчики рецептов переносятся
+        previous_author_id = form.initial.get('author')
+        super().save_model(request, obj, form, change)
+        if change and 'author' in form.changed_data:
+            counters.recipes_changed(previous_author_id, -1)
+            counters.recipes_changed(obj.author_id, 1)
+
+    def save_related(self, request, form, formsets, change):
+        super().save_related(request, form, formsets, change)
+        if change:
+            shopping_list.refresh_recipe(form.instance.id)
 
     fieldsets = (
         (None, {'fields': ('name', 'author', 'image', 'text', 'cooking_time')}),
@@ -0,0 +1,24 @@
+import copy
+
+from django.contrib.postgres.indexes import OpClass
+from django.db import models
+
+
+class OpClassIndex(models.Index):
+    """Индекс по выражениям с классами операторов (OpClass).
+
+    Классы операторов есть только в PostgreSQL; в SQLite (база разработки)
+    индекс строится по самим выражениям, чтобы миграции проходили и там."""
+
+    def create_sql(self, model, schema_editor, using='', **kwargs):
+        index = self
+        if schema_editor.connection.vendor != 'postgresql':
+            index = copy.copy(self)
+            index.expressions = tuple(
+                expression.get_source_expressions()[0]
+                if isinstance(expression, OpClass) else expression
+                for expression in self.expressions
+            )
+        return super(OpClassIndex, index).create_sql(
+            model, schema_editor, using=using, **kwargs
+        )
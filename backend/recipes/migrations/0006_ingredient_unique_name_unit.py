@@ -0,0 +1,73 @@
+# Generated by Django 4.2.22 on 2026-10-18 04:00
+
+from django.db import migrations, models
+from django.db.models import Count, Min, Sum
+
+AMOUNT_MAX = 32767
+
+
+def merge_duplicate_ingredients(apps, schema_editor):
+    # Ограничение не создать, пока в справочнике есть дубли:
+    # остаётся ингредиент с меньшим id, рецепты переводятся на него
+    Ingredient = apps.get_model('recipes', 'Ingredient')
+    IngredientRecipe = apps.get_model('recipes', 'IngredientRecipe')
+    duplicates = (
+        Ingredient.objects
+        .values('name', 'measurement_unit')
+        .annotate(keep_id=Min('id'), count=Count('id'))
+        .filter(count__gt=1)
+    )
+    kept_ids = []
+    for group in duplicates:
+        extra_ids = list(
+            Ingredient.objects
+            .filter(
+                name=group['name'],
+                measurement_unit=group['measurement_unit'],
+            )
+            .exclude(id=group['keep_id'])
+            .values_list('id', flat=True)
+        )
+        IngredientRecipe.objects.filter(ingredient_id__in=extra_ids).update(
+            ingredient_id=group['keep_id']
+        )
+        Ingredient.objects.filter(id__in=extra_ids).delete()
+        kept_ids.append(group['keep_id'])
+
+    # Если в рецепте были оба дубля, их количества складываются в одну строку
+    repeated = (
+        IngredientRecipe.objects
+        .filter(ingredient_id__in=kept_ids)
+        .values('recipe_id', 'ingredient_id')
+        .annotate(keep_id=Min('id'), total=Sum('amount'), count=Count('id'))
+        .filter(count__gt=1)
+    )
+    for row in repeated:
+        IngredientRecipe.objects.filter(id=row['keep_id']).update(
+            amount=min(row['total'], AMOUNT_MAX)
+        )
+        IngredientRecipe.objects.filter(
+            recipe_id=row['recipe_id'], ingredient_id=row['ingredient_id'],
+        ).exclude(id=row['keep_id']).delete()
+
+    if schema_editor.connection.vendor == 'postgresql':
+        # Отложенные проверки внешних ключей не дают изменить таблицу
+        # в той же транзакции («pending trigger events»)
+        schema_editor.execute('SET CONSTRAINTS ALL IMMEDIATE')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0005_alter_ingredientrecipe_recipe'),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            merge_duplicate_ingredients, migrations.RunPython.noop
+        ),
+        migrations.AddConstraint(
+            model_name='ingredient',
+            constraint=models.UniqueConstraint(fields=('name', 'measurement_unit'), name='unique_ingredient_measurement_unit'),
+        ),
+    ]
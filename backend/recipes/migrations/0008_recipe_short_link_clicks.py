@@ -0,0 +1,18 @@
+# Generated by Django 4.2.22 on 2026-10-18 04:16
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0007_updated_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='short_link_clicks',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Переходов по короткой ссылке'),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 4.2.22 on 2026-10-18 04:21
+
+import django.contrib.postgres.indexes
+import django.db.models.functions.text
+from django.db import migrations, models
+
+import recipes.indexes
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0009_recipe_search'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='ingredientrecipe',
+            index=models.Index(fields=['recipe', 'ingredient'], name='ingr_recipe_recipe_ingr_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='recipe',
+            index=models.Index(fields=['author', 'id'], name='recipe_author_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='ingredient',
+            index=recipes.indexes.OpClassIndex(django.contrib.postgres.indexes.OpClass(django.db.models.functions.text.Upper('name'), name='text_pattern_ops'), name='ingredient_name_prefix_idx'),
+        ),
+    ]
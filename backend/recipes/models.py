@@ -1,5 +1,10 @@
+from django.contrib.postgres.indexes import OpClass
 from django.core.validators import MinValueValidator
 from django.db import models
+from django.db.models.functions import Upper
+
+from recipes.indexes import OpClassIndex
+from users.counters import CountersModel
 
 RECIPE_NAME_MAX_LENGTH = 256
 INGREDIENT_NAME_MAX_LENGTH = 128
@@ -17,17 +22,35 @@ class Ingredient(models.Model):
         blank=False,
         verbose_name="Ед. измерения"
     )
+    updated_at = models.DateTimeField(
+        auto_now=True,
+        verbose_name="Изменено",
+    )
 
     class Meta:
         verbose_name = "Ингредиент"
         verbose_name_plural = "Ингредиенты"
         ordering = ['name']
+        constraints = [
+            models.UniqueConstraint(
+                fields=["name", "measurement_unit"],
+                name="unique_ingredient_measurement_unit",
+            )
+        ]
+        indexes = [
+            # name__istartswith в PostgreSQL — UPPER(name) LIKE 'X%',
+            # обычный индекс по name для него не подходит
+            OpClassIndex(
+                OpClass(Upper('name'), name='text_pattern_ops'),
+                name='ingredient_name_prefix_idx',
+            ),
+        ]
 
     def __str__(self):
         return f"{self.name}, {self.measurement_unit}"
 
 
-class Recipe(models.Model):
+class Recipe(CountersModel):
     author = models.ForeignKey(
         'users.User',
         on_delete=models.CASCADE,
@@ -61,11 +84,39 @@ class Recipe(models.Model):
         through_fields=('recipe', 'ingredient'),
         related_name='recipes'
     )
+    updated_at = models.DateTimeField(
+        auto_now=True,
+        verbose_name="Изменено",
+    )
+    short_link_clicks = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        verbose_name="Переходов по короткой ссылке",
+    )
+    # Счётчики поддерживаются users.counters
+    favorites_count = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        verbose_name="В избранном у",
+    )
+    in_carts_count = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        verbose_name="В корзинах у",
+    )
+
+    counter_fields = (
+        'short_link_clicks', 'favorites_count', 'in_carts_count',
+    )
 
     class Meta:
         verbose_name = "Рецепт"
         verbose_name_plural = "Рецепты"
         ordering = ("id",)
+        indexes = [
+            # Рецепты автора в порядке id: фильтр author и подписки
+            models.Index(fields=["author", "id"], name="recipe_author_id_idx"),
+        ]
 
     def __str__(self):
         return self.name
@@ -95,6 +146,12 @@ class IngredientRecipe(models.Model):
     class Meta:
         verbose_name = 'Ингредиент в рецепте'
         verbose_name_plural = 'Ингредиенты в рецепте'
+        indexes = [
+            models.Index(
+                fields=['recipe', 'ingredient'],
+                name='ingr_recipe_recipe_ingr_idx',
+            ),
+        ]
 
     def __str__(self):
         return f"{self.ingredient.name}, {self.amount}"
@@ -0,0 +1,173 @@
+import re
+
+from django.db import connections
+from django.db.models import BooleanField, FloatField, Q, Value
+from django.db.models.expressions import RawSQL
+
+# Модуль используется в миграциях, поэтому модели не импортируются
+RECIPE_TABLE = 'recipes_recipe'
+SEARCH_CONFIG = 'russian'
+SQLITE_FTS_TABLE = 'recipes_recipe_fts'
+# Окончания длинных слов отбрасываются, чтобы FTS5 без русского
+# стеммера находил другие формы слова по префиксу
+SQLITE_ENDING_LENGTH = 2
+SQLITE_MIN_STEM_LENGTH = 4
+WORD = re.compile(r'\w+')
+
+POSTGRESQL_INSTALL = (
+    # Вектор хранится в сгенерированном столбце и обновляется
+    # самой базой при изменении name или text
+    f"""
+    ALTER TABLE recipes_recipe ADD COLUMN search_vector tsvector
+    GENERATED ALWAYS AS (
+        setweight(to_tsvector('{SEARCH_CONFIG}', coalesce(name, '')), 'A')
+        || setweight(to_tsvector('{SEARCH_CONFIG}', coalesce(text, '')), 'B')
+    ) STORED
+    """,
+    'CREATE INDEX recipes_recipe_search_vector_idx '
+    'ON recipes_recipe USING GIN (search_vector)',
+)
+POSTGRESQL_UNINSTALL = (
+    'DROP INDEX IF EXISTS recipes_recipe_search_vector_idx',
+    'ALTER TABLE recipes_recipe DROP COLUMN IF EXISTS search_vector',
+)
+
+SQLITE_INSTALL = (
+    f"""
+    CREATE VIRTUAL TABLE IF NOT EXISTS {SQLITE_FTS_TABLE} USING fts5(
+        name, text,
+        content='recipes_recipe', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2'
+    )
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {SQLITE_FTS_TABLE}_insert
+    AFTER INSERT ON recipes_recipe BEGIN
+        INSERT INTO {SQLITE_FTS_TABLE} (rowid, name, text)
+        VALUES (new.id, new.name, new.text);
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {SQLITE_FTS_TABLE}_delete
+    AFTER DELETE ON recipes_recipe BEGIN
+        INSERT INTO {SQLITE_FTS_TABLE} ({SQLITE_FTS_TABLE}, rowid, name, text)
+        VALUES ('delete', old.id, old.name, old.text);
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {SQLITE_FTS_TABLE}_update
+    AFTER UPDATE OF name, text ON recipes_recipe BEGIN
+        INSERT INTO {SQLITE_FTS_TABLE} ({SQLITE_FTS_TABLE}, rowid, name, text)
+        VALUES ('delete', old.id, old.name, old.text);
+        INSERT INTO {SQLITE_FTS_TABLE} (rowid, name, text)
+        VALUES (new.id, new.name, new.text);
+    END
+    """,
+)
+SQLITE_UNINSTALL = (
+    f'DROP TRIGGER IF EXISTS {SQLITE_FTS_TABLE}_insert',
+    f'DROP TRIGGER IF EXISTS {SQLITE_FTS_TABLE}_delete',
+    f'DROP TRIGGER IF EXISTS {SQLITE_FTS_TABLE}_update',
+    f'DROP TABLE IF EXISTS {SQLITE_FTS_TABLE}',
+)
+SQLITE_TRIGGER_COUNT = 3
+
+
+def install(connection):
+    """Создаёт поисковый индекс рецептов для текущей СУБД.
+    Для остальных СУБД поиск работает без индекса."""
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            for statement in POSTGRESQL_INSTALL:
+                cursor.execute(statement)
+        elif connection.vendor == 'sqlite':
+            for statement in SQLITE_INSTALL:
+                cursor.execute(statement)
+            cursor.execute(
+                f"INSERT INTO {SQLITE_FTS_TABLE} ({SQLITE_FTS_TABLE}) "
+                "VALUES ('rebuild')"
+            )
+
+
+def uninstall(connection):
+    statements = {
+        'postgresql': POSTGRESQL_UNINSTALL,
+        'sqlite': SQLITE_UNINSTALL,
+    }.get(connection.vendor, ())
+    with connection.cursor() as cursor:
+        for statement in statements:
+            cursor.execute(statement)
+
+
+def ensure_sqlite_triggers(using, **kwargs):
+    # SQLite пересоздаёт таблицу при изменении её схемы миграциями,
+    # вместе со старой таблицей пропадают и триггеры поиска
+    connection = connections[using]
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT count(*) FROM sqlite_master WHERE type = 'trigger' "
+            "AND tbl_name = 'recipes_recipe' AND name LIKE %s",
+            [f'{SQLITE_FTS_TABLE}_%'],
+        )
+        triggers = cursor.fetchone()[0]
+        cursor.execute(
+            "SELECT count(*) FROM sqlite_master WHERE name = %s",
+            [SQLITE_FTS_TABLE],
+        )
+        has_table = cursor.fetchone()[0]
+    if has_table and triggers < SQLITE_TRIGGER_COUNT:
+        install(connection)
+
+
+def sqlite_match_query(query):
+    terms = []
+    for word in WORD.findall(query.lower()):
+        if len(word) - SQLITE_ENDING_LENGTH >= SQLITE_MIN_STEM_LENGTH:
+            word = word[:-SQLITE_ENDING_LENGTH]
+        terms.append(f'"{word}"*')
+    return ' '.join(terms)
+
+
+def search(queryset, query):
+    """Рецепты, подходящие под поисковый запрос, с аннотацией
+    search_rank: чем больше, тем выше совпадение."""
+    if not WORD.search(query):
+        return queryset.none().annotate(
+            search_rank=Value(0.0, output_field=FloatField())
+        )
+    connection = connections[queryset.db]
+    table = RECIPE_TABLE
+    if connection.vendor == 'postgresql':
+        tsquery = f"websearch_to_tsquery('{SEARCH_CONFIG}', %s)"
+        return queryset.filter(RawSQL(
+            f'"{table}"."search_vector" @@ {tsquery}',
+            [query],
+            output_field=BooleanField(),
+        )).annotate(search_rank=RawSQL(
+            f'ts_rank_cd("{table}"."search_vector", {tsquery})::float8',
+            [query],
+            output_field=FloatField(),
+        ))
+    if connection.vendor == 'sqlite':
+        match = sqlite_match_query(query)
+        # bm25 тем меньше, чем лучше совпадение; название весит больше
+        return queryset.filter(id__in=RawSQL(
+            f'SELECT rowid FROM {SQLITE_FTS_TABLE} '
+            f'WHERE {SQLITE_FTS_TABLE} MATCH %s',
+            [match],
+        )).annotate(search_rank=RawSQL(
+            f'SELECT -bm25({SQLITE_FTS_TABLE}, 10.0, 1.0) '
+            f'FROM {SQLITE_FTS_TABLE} '
+            f'WHERE {SQLITE_FTS_TABLE} MATCH %s '
+            f'AND {SQLITE_FTS_TABLE}.rowid = "{table}"."id"',
+            [match],
+            output_field=FloatField(),
+        ))
+    condition = Q()
+    for word in WORD.findall(query):
+        condition &= Q(name__icontains=word) | Q(text__icontains=word)
+    return queryset.filter(condition).annotate(
+        search_rank=Value(0.0, output_field=FloatField())
+    )
@@ -0,0 +1,118 @@
+from django.apps import apps
+from django.db import models, transaction
+from django.db.models import Count, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce, Greatest
+
+# Модуль используется в миграциях, поэтому модели не импортируются,
+# а берутся через get_model.
+# Счётчик: (модель, поле счётчика, считаемая модель, её внешний ключ)
+COUNTERS = (
+    ('recipes.Recipe', 'favorites_count', 'users.Favorite', 'recipe'),
+    ('recipes.Recipe', 'in_carts_count', 'users.ShoppingCart', 'recipe'),
+    ('users.User', 'recipes_count', 'recipes.Recipe', 'author'),
+    ('users.User', 'followers_count', 'users.Follow', 'following'),
+    ('users.User', 'following_count', 'users.Follow', 'user'),
+)
+RECIPE_RELATION_COUNTERS = {
+    'Favorite': 'favorites_count',
+    'ShoppingCart': 'in_carts_count',
+}
+
+
+class CountersModel(models.Model):
+    """Модель со счётчиками, которые меняются только UPDATE в базе.
+
+    Обычный save() существующего объекта записал бы значения счётчиков,
+    прочитанные при загрузке, и затёр бы изменения из других запросов,
+    поэтому поля counter_fields в такой save() не попадают."""
+
+    counter_fields = ()
+
+    class Meta:
+        abstract = True
+
+    def save(self, *args, **kwargs):
+        if (
+            not self._state.adding
+            and not args
+            and kwargs.get('update_fields') is None
+            and not kwargs.get('force_insert')
+        ):
+            deferred = self.get_deferred_fields()
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key
+                and field.name not in self.counter_fields
+                and field.attname not in deferred
+            ]
+        super().save(*args, **kwargs)
+
+
+def change(model, ids, field, delta):
+    # Изменение считает сама база, без чтения значения в Python
+    if delta and ids:
+        apps.get_model(model).objects.filter(id__in=ids).update(
+            **{field: Greatest(F(field) + delta, 0)}
+        )
+
+
+def recipe_relations_changed(relation_model, recipe_ids, delta):
+    """Избранное или корзина (relation_model) пополнились (delta > 0)
+    или лишились (delta < 0) рецептов recipe_ids."""
+    change(
+        'recipes.Recipe',
+        recipe_ids,
+        RECIPE_RELATION_COUNTERS[relation_model.__name__],
+        delta,
+    )
+
+
+def follows_changed(user_id, following_ids, delta):
+    change('users.User', following_ids, 'followers_count', delta)
+    change('users.User', [user_id], 'following_count', delta * len(following_ids))
+
+
+def recipes_changed(author_id, delta):
+    change('users.User', [author_id], 'recipes_count', delta)
+
+
+def actual_count(related_model, field):
+    return Coalesce(
+        Subquery(
+            related_model.objects
+            .filter(**{field: OuterRef('pk')})
+            .order_by()
+            .values(field)
+            .annotate(count=Count('pk'))
+            .values('count')
+        ),
+        0,
+    )
+
+
+def mismatched(get_model=apps.get_model):
+    """Объекты с неверными счётчиками: {(модель, поле): queryset}."""
+    result = {}
+    for model, field, related_model, related_field in COUNTERS:
+        result[model, field] = (
+            get_model(model).objects
+            .annotate(actual=actual_count(
+                get_model(related_model), related_field
+            ))
+            .exclude(**{field: F('actual')})
+        )
+    return result
+
+
+@transaction.atomic
+def rebuild(get_model=apps.get_model):
+    """Пересчитывает счётчики с нуля. Возвращает число исправленных
+    значений."""
+    fixed = 0
+    for model, field, related_model, related_field in COUNTERS:
+        objects = get_model(model).objects
+        wrong = mismatched(get_model)[model, field]
+        fixed += objects.filter(pk__in=wrong.values('pk')).update(**{
+            field: actual_count(get_model(related_model), related_field)
+        })
+    return fixed
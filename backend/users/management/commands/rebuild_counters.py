@@ -0,0 +1,38 @@
+from django.core.management.base import BaseCommand
+
+from users import counters
+
+
+class Command(BaseCommand):
+    help = (
+        'Пересчитывает счётчики избранного, корзин, рецептов и подписок '
+        'по фактическим данным'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--check', action='store_true',
+            help='Только найти расхождения, ничего не записывая',
+        )
+
+    def handle(self, *args, **options):
+        if options['check']:
+            found = False
+            for (model, field), wrong in counters.mismatched().items():
+                ids = list(wrong.values_list('pk', flat=True)[:20])
+                if ids:
+                    found = True
+                    self.stdout.write(self.style.WARNING(
+                        f'{model}.{field} расходится у объектов: '
+                        f'{", ".join(map(str, ids))}'
+                    ))
+            if not found:
+                self.stdout.write(self.style.SUCCESS(
+                    'Счётчики согласованы с данными'
+                ))
+            return
+
+        fixed = counters.rebuild()
+        self.stdout.write(self.style.SUCCESS(
+            f'Счётчики пересчитаны, исправлено значений: {fixed}'
+        ))
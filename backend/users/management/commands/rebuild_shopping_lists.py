@@ -0,0 +1,50 @@
+from django.core.management.base import BaseCommand
+
+from users import shopping_list
+from users.models import ShoppingListItem
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает сводные списки покупок пользователей с нуля'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--check', action='store_true',
+            help='Только сравнить с корзинами, ничего не записывая',
+        )
+
+    def handle(self, *args, **options):
+        if options['check']:
+            mismatched = self.find_mismatched_users()
+            if mismatched:
+                self.stdout.write(self.style.WARNING(
+                    f'Расходятся списки покупок пользователей: '
+                    f'{", ".join(map(str, sorted(mismatched)))}'
+                ))
+            else:
+                self.stdout.write(self.style.SUCCESS(
+                    'Списки покупок согласованы с корзинами'
+                ))
+            return
+
+        written = shopping_list.rebuild()
+        self.stdout.write(self.style.SUCCESS(
+            f'Списки покупок пересчитаны, строк: {written}'
+        ))
+
+    def find_mismatched_users(self):
+        expected = {
+            (row['recipe__shopping_carts__user_id'], row['ingredient_id']):
+                row['total']
+            for row in shopping_list.expected_items().iterator()
+        }
+        mismatched = set()
+        for user_id, ingredient_id, amount in (
+            ShoppingListItem.objects
+            .values_list('user_id', 'ingredient_id', 'amount')
+            .iterator()
+        ):
+            if expected.pop((user_id, ingredient_id), None) != amount:
+                mismatched.add(user_id)
+        mismatched.update(user_id for user_id, _ in expected)
+        return mismatched
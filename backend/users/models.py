@@ -1,7 +1,8 @@
 from django.contrib.auth.models import AbstractUser
 from django.core.validators import RegexValidator
 from django.db import models
-from recipes.models import Recipe
+from recipes.models import Ingredient, Recipe
+from users.counters import CountersModel
 
 USER_SELF_DATA_MAX_LENGTH = 150
 USER_MAIL_MAX_LENGTH = 255
@@ -9,7 +10,7 @@ USER_NAME_REGEX_VALIDATOR = RegexValidator(regex=r'^[\w.@+-]+$')
 
 
 # Модель пользователя системы на основе встроенной во фреймворке модели User
-class User(AbstractUser):
+class User(CountersModel, AbstractUser):
     # Без этих строчек не работает авторизация. Просто абсурд
     USERNAME_FIELD = 'email'
     REQUIRED_FIELDS = ('username', 'first_name', 'last_name')
@@ -42,6 +43,24 @@ class User(AbstractUser):
         verbose_name="Аватар",
         upload_to='avatars/',
     )
+    # Счётчики поддерживаются users.counters
+    recipes_count = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        verbose_name="Рецептов",
+    )
+    followers_count = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        verbose_name="Подписчиков",
+    )
+    following_count = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        verbose_name="Подписок",
+    )
+
+    counter_fields = ('recipes_count', 'followers_count', 'following_count')
 
     class Meta:
         verbose_name = "Пользователь"
@@ -114,3 +133,37 @@ class ShoppingCart(UserRecipeRelation):
         verbose_name = "Список покупок"
         verbose_name_plural = "Списки покупок"
         default_related_name = "shopping_carts"
+
+
+# Сводный список покупок пользователя: суммарное количество каждого
+# ингредиента по всем рецептам в корзине. Поддерживается users.shopping_list
+class ShoppingListItem(models.Model):
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name="shopping_list",
+        verbose_name="Пользователь",
+    )
+    ingredient = models.ForeignKey(
+        Ingredient,
+        on_delete=models.CASCADE,
+        related_name="shopping_list_items",
+        verbose_name="Ингредиент",
+    )
+    amount = models.PositiveIntegerField(
+        default=0,
+        verbose_name="Количество",
+    )
+
+    class Meta:
+        verbose_name = "Ингредиент списка покупок"
+        verbose_name_plural = "Ингредиенты списков покупок"
+        constraints = [
+            models.UniqueConstraint(
+                fields=["user", "ingredient"],
+                name="unique_user_ingredient_shopping_list",
+            )
+        ]
+
+    def __str__(self):
+        return f"{self.user} {self.ingredient.name} {self.amount}"
@@ -0,0 +1,127 @@
+from django.db import connection, transaction
+from django.db.models import Sum
+
+from recipes.models import IngredientRecipe
+from users.models import ShoppingCart, ShoppingListItem, User
+
+
+def recipe_totals(recipe_ids):
+    return {
+        row['ingredient_id']: row['total']
+        for row in (
+            IngredientRecipe.objects
+            .filter(recipe_id__in=recipe_ids)
+            .values('ingredient_id')
+            .annotate(total=Sum('amount'))
+        )
+    }
+
+
+def lock_lists(user_ids):
+    # select_for_update по строкам списка не защищает от вставки ещё
+    # не существующих строк, поэтому списки пользователя меняются
+    # по очереди под блокировкой его строки в users_user.
+    # Порядок по id исключает взаимные блокировки
+    if not connection.features.has_select_for_update:
+        return
+    list(
+        User.objects.select_for_update()
+        .filter(pk__in=user_ids).order_by('pk')
+        .values_list('pk', flat=True)
+    )
+
+
+@transaction.atomic
+def change_amounts(user_id, recipe_ids, sign):
+    """Прибавляет (sign=1) или вычитает (sign=-1) ингредиенты рецептов
+    из списка покупок пользователя."""
+    totals = recipe_totals(recipe_ids)
+    if not totals:
+        return
+    lock_lists([user_id])
+    items = {
+        item.ingredient_id: item
+        for item in ShoppingListItem.objects.select_for_update().filter(
+            user_id=user_id, ingredient_id__in=totals
+        )
+    }
+    changed, created, emptied = [], [], []
+    for ingredient_id, total in totals.items():
+        item = items.get(ingredient_id)
+        if item is None:
+            if sign > 0:
+                created.append(ShoppingListItem(
+                    user_id=user_id, ingredient_id=ingredient_id, amount=total
+                ))
+            continue
+        item.amount += sign * total
+        if item.amount > 0:
+            changed.append(item)
+        else:
+            emptied.append(item.id)
+    ShoppingListItem.objects.bulk_create(created)
+    ShoppingListItem.objects.bulk_update(changed, ['amount'])
+    ShoppingListItem.objects.filter(id__in=emptied).delete()
+
+
+def add_recipes(user_id, recipe_ids):
+    change_amounts(user_id, recipe_ids, 1)
+
+
+def remove_recipes(user_id, recipe_ids):
+    change_amounts(user_id, recipe_ids, -1)
+
+
+def expected_items(user_ids=None):
+    # Список покупок, посчитанный заново по корзинам
+    # Условие на корзину задаётся одним filter(), иначе для
+    # многозначной связи Django добавит второй JOIN и суммы удвоятся
+    if user_ids is None:
+        rows = IngredientRecipe.objects.filter(
+            recipe__shopping_carts__isnull=False
+        )
+    else:
+        rows = IngredientRecipe.objects.filter(
+            recipe__shopping_carts__user_id__in=user_ids
+        )
+    return (
+        rows
+        .values('recipe__shopping_carts__user_id', 'ingredient_id')
+        .annotate(total=Sum('amount'))
+        .order_by()
+    )
+
+
+@transaction.atomic
+def rebuild(user_ids=None):
+    """Пересчитывает списки покупок пользователей (всех, если user_ids
+    не передан) с нуля. Возвращает число записанных строк."""
+    items = ShoppingListItem.objects.all()
+    if user_ids is not None:
+        lock_lists(user_ids)
+        items = items.filter(user_id__in=user_ids)
+    items.delete()
+    written = 0
+    batch = []
+    for row in expected_items(user_ids).iterator(chunk_size=2000):
+        batch.append(ShoppingListItem(
+            user_id=row['recipe__shopping_carts__user_id'],
+            ingredient_id=row['ingredient_id'],
+            amount=row['total'],
+        ))
+        if len(batch) >= 1000:
+            written += len(ShoppingListItem.objects.bulk_create(batch))
+            batch = []
+    written += len(ShoppingListItem.objects.bulk_create(batch))
+    return written
+
+
+def refresh_recipe(recipe_id):
+    # Состав рецепта изменился: пересчитываем списки тех,
+    # у кого рецепт лежит в корзине
+    user_ids = list(
+        ShoppingCart.objects.filter(recipe_id=recipe_id)
+        .values_list('user_id', flat=True)
+    )
+    if user_ids:
+        rebuild(user_ids)
@@ -0,0 +1,56 @@
+from django.db.models.signals import post_delete, post_save, pre_delete
+from django.dispatch import receiver
+
+from recipes.models import Recipe
+from users import counters, shopping_list
+from users.models import Favorite, Follow, ShoppingCart
+
+
+@receiver(post_save, sender=ShoppingCart)
+def shopping_cart_added(instance, created, **kwargs):
+    if created:
+        shopping_list.add_recipes(instance.user_id, [instance.recipe_id])
+
+
+# pre_delete, а не post_delete: при каскадном удалении рецепта
+# его ингредиенты ещё не удалены и их можно вычесть
+@receiver(pre_delete, sender=ShoppingCart)
+def shopping_cart_removed(instance, **kwargs):
+    shopping_list.remove_recipes(instance.user_id, [instance.recipe_id])
+
+
+@receiver(post_save, sender=Favorite)
+@receiver(post_save, sender=ShoppingCart)
+def recipe_relation_added(sender, instance, created, **kwargs):
+    if created:
+        counters.recipe_relations_changed(sender, [instance.recipe_id], 1)
+
+
+@receiver(post_delete, sender=Favorite)
+@receiver(post_delete, sender=ShoppingCart)
+def recipe_relation_removed(sender, instance, **kwargs):
+    counters.recipe_relations_changed(sender, [instance.recipe_id], -1)
+
+
+@receiver(post_save, sender=Follow)
+def follow_added(instance, created, **kwargs):
+    if created:
+        counters.follows_changed(
+            instance.user_id, [instance.following_id], 1
+        )
+
+
+@receiver(post_delete, sender=Follow)
+def follow_removed(instance, **kwargs):
+    counters.follows_changed(instance.user_id, [instance.following_id], -1)
+
+
+@receiver(post_save, sender=Recipe)
+def recipe_added(instance, created, **kwargs):
+    if created:
+        counters.recipes_changed(instance.author_id, 1)
+
+
+@receiver(post_delete, sender=Recipe)
+def recipe_removed(instance, **kwargs):
+    counters.recipes_changed(instance.author_id, -1)